@@ -8,6 +8,7 @@ setup(
     name = 'yieldfrom_t.http.client',
     description = 'asyncio version of http.client',
     install_requires = ['setuptools','trollius'],
+    extras_require = {'http2': ['h2']},
 
     author = 'David Keeney',
     author_email = 'dkeeney@rdbhost.com',
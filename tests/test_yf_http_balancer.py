@@ -0,0 +1,98 @@
+import sys
+import trollius as asyncio
+from trollius import From, Return
+
+import unittest
+
+sys.path.insert(0, '..')
+from yieldfrom_t.http import balancer
+
+TestCase = unittest.TestCase
+
+testLoop = asyncio.get_event_loop()
+
+ENDPOINTS = [('a.test', 80), ('b.test', 80), ('c.test', 80)]
+
+
+class IdleSocket(object):
+    """stands in for an idle NotSocket"""
+
+    def __init__(self):
+        self.closed = False
+
+    def is_stale(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class LoadBalancerTest(TestCase):
+
+    def _acquire(self, lb):
+        return testLoop.run_until_complete(lb.acquire())
+
+    def test_least_outstanding(self):
+        lb = balancer.LoadBalancer(ENDPOINTS, strategy='least_outstanding', loop=testLoop)
+        conns = [self._acquire(lb) for _ in range(3)]
+        self.assertEqual(sorted(c.host for c in conns), ['a.test', 'b.test', 'c.test'])
+        lb.release(conns[1], latency=0.01, status=200)
+        self.assertEqual(self._acquire(lb).host, conns[1].host)
+
+    def test_p2c_prefers_fast(self):
+        lb = balancer.LoadBalancer(ENDPOINTS[:2], loop=testLoop)
+        a, b = lb.endpoints
+        a.latency, b.latency = 0.5, 0.01
+        for _ in range(3):
+            conn = self._acquire(lb)
+            self.assertEqual(conn.host, 'b.test')
+            lb.release(conn)
+        self.assertEqual(b.outstanding, 0)
+
+    def test_p2c_without_latency(self):
+        # with no latency samples, requests in flight decide
+        lb = balancer.LoadBalancer(ENDPOINTS[:2], loop=testLoop)
+        conns = [self._acquire(lb) for _ in range(4)]
+        self.assertEqual([e.outstanding for e in lb.endpoints], [2, 2])
+        lb.release(conns[0], status=200)
+        self.assertEqual(self._acquire(lb).host, conns[0].host)
+
+    def test_p2c_unsampled_endpoint_tried(self):
+        lb = balancer.LoadBalancer(ENDPOINTS[:2], loop=testLoop)
+        a, b = lb.endpoints
+        a.latency = 0.01
+        a.outstanding = 1
+        # b counts as typical (0.01), and has nothing in flight
+        self.assertIs(lb.choose(), b)
+
+    def test_prefers_idle_connection(self):
+        lb = balancer.LoadBalancer(ENDPOINTS, strategy='least_outstanding', loop=testLoop)
+        ns = IdleSocket()
+        lb.endpoints[2].pool._idle.append((ns, testLoop.time()))
+        conn = self._acquire(lb)
+        self.assertIs(conn.notSock, ns)
+
+    def test_ejection(self):
+        lb = balancer.LoadBalancer(ENDPOINTS[:2], strategy='least_outstanding',
+                                   max_failures=2, eject_time=30, loop=testLoop)
+        a = lb.endpoints[0]
+        for status in (503, None):
+            conn = self._acquire(lb)
+            self.assertEqual(conn.host, 'a.test')
+            lb.release(conn, status=status, error=status is None)
+        self.assertFalse(a.available(testLoop.time()))
+        for _ in range(3):
+            conn = self._acquire(lb)
+            self.assertEqual(conn.host, 'b.test')
+            lb.release(conn, status=200)
+        a.ejected_until = testLoop.time()
+        conn = self._acquire(lb)
+        lb.release(conn, status=200)
+        self.assertEqual((a.failures, a.ejected_until), (0, None))
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, balancer.LoadBalancer, ENDPOINTS, strategy='random')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ from trollius import From, Return
 import os
 import re
 import functools
+import zlib
 
 
 import unittest
@@ -1486,6 +1487,76 @@ class SourceAddressTest(TestCase):
 #         _run_with_server(_run, '')
 
 
+class SourceAddressPoolTest(TestCase):
+
+    def _sock(self, family=socket.AF_INET):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_rotation(self):
+        sources = client.SourceAddressPool(['127.0.0.1', ('127.0.0.2', 0)])
+        bound = [sources.bind(self._sock()) for _ in range(4)]
+        self.assertEqual([b[0] for b in bound],
+                         ['127.0.0.1', '127.0.0.2', '127.0.0.1', '127.0.0.2'])
+        self.assertEqual(sources.stats()[('127.0.0.1', 0)], {'connections': 2, 'failures': 0})
+
+    def test_skip_address_in_use(self):
+        busy = self._sock()
+        busy.bind(('127.0.0.1', 0))
+        busy.listen(1)
+        in_use = busy.getsockname()
+        sources = client.SourceAddressPool([in_use, '127.0.0.1'])
+        self.assertEqual(sources.bind(self._sock()), ('127.0.0.1', 0))
+        self.assertEqual(sources.stats()[in_use], {'connections': 0, 'failures': 1})
+
+    def test_family(self):
+        sources = client.SourceAddressPool(['::1'])
+        self.assertRaises(socket.error, sources.bind, self._sock())
+
+    def test_text_address(self):
+        sources = client.SourceAddressPool([u'127.0.0.1'])
+        self.assertEqual(sources.addresses, [(u'127.0.0.1', 0)])
+
+    @unittest.skipIf(client.IP_BIND_ADDRESS_NO_PORT is None, 'needs IP_BIND_ADDRESS_NO_PORT')
+    def test_port_picked_at_connect(self):
+        sources = client.SourceAddressPool(['127.0.0.1'])
+        sock = self._sock()
+        sources.bind(sock)
+        self.assertEqual(sock.getsockopt(socket.IPPROTO_IP, client.IP_BIND_ADDRESS_NO_PORT), 1)
+        self.assertEqual(sock.getsockname(), ('127.0.0.1', 0))
+
+    def test_ports_used_up_at_connect(self):
+        attempts = []
+
+        class Loop(object):
+            @asyncio.coroutine
+            def sock_connect(self, sock, address):
+                attempts.append(sock.getsockname()[0])
+                if len(attempts) == 1:
+                    raise socket.error(errno.EADDRNOTAVAIL, 'no ports left')
+
+        sources = client.SourceAddressPool(['127.0.0.1', '127.0.0.2'])
+        addrinfo = (socket.AF_INET, socket.SOCK_STREAM, 0, '', ('127.0.0.1', 80))
+        sock = testLoop.run_until_complete(client._connect_sock(Loop(), addrinfo, sources))
+        sock.close()
+        self.assertEqual(attempts, ['127.0.0.1', '127.0.0.2'])
+        self.assertEqual(sources.stats()[('127.0.0.1', 0)], {'connections': 1, 'failures': 1})
+
+    def test_connection(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            sources = client.SourceAddressPool(['127.0.0.1'])
+            conn = client.HTTPConnection(host, port, source_address=sources)
+            yield From (conn.connect())
+            self.assertEqual(conn.notSock.socket().getsockname()[0], '127.0.0.1')
+            conn.close()
+            self.assertEqual(sources.connections[('127.0.0.1', 0)], 1)
+
+        _run_with_server(_run, '')
+
+
 class HTTPSTest(TestCase):
 
     def setUp(self):
@@ -1820,6 +1891,1244 @@ class HTTPResponseTest(TestCase):
 
         _run_with_server(_run, self.body)
 
+
+class KeepAliveTest(TestCase):
+
+    body = 'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nHello'
+
+    def test_reuse_connection(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.request('GET', '/one'))
+            resp = yield From (conn.getresponse())
+            ns = conn.notSock
+            self.assertIsNotNone(ns)
+            d = yield From (resp.read())
+            self.assertEqual(d, b'Hello')
+            self.assertTrue(resp.isclosed())
+            self.assertEqual(ns.transportRefCt, 1)
+
+            yield From (conn.request('GET', '/two'))
+            resp = yield From (conn.getresponse())
+            self.assertIs(conn.notSock, ns)
+            d = yield From (resp.read())
+            self.assertEqual(d, b'Hello')
+            conn.close()
+            self.assertIsNone(ns.writer)
+
+        _run_with_server(_run, [RECEIVE, self.body, RECEIVE, self.body])
+
+    def test_connection_close(self):
+        body = ('HTTP/1.1 200 OK\r\nConnection: close\r\n'
+                'Content-Length: 5\r\n\r\nHello')
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            self.assertIsNone(conn.notSock)
+            d = yield From (resp.read())
+            self.assertEqual(d, b'Hello')
+            self.assertIsNone(resp.fp)
+
+        _run_with_server(_run, body)
+
+    def test_stale_connection_replaced(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.request('GET', '/one'))
+            resp = yield From (conn.getresponse())
+            ns = conn.notSock
+            yield From (resp.read())
+            # server closes its end after the first response
+            yield From (asyncio.sleep(0.2))
+            self.assertTrue(ns.is_stale())
+
+            yield From (conn.request('GET', '/two'))
+            self.assertIsNot(conn.notSock, ns)
+            self.assertIsNone(ns.writer)
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'Hello')
+            conn.close()
+
+        _run_with_server(_run, self.body)
+
+    def test_unread_body_not_reused(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            ns = conn.notSock
+            resp.close()
+            self.assertTrue(ns.is_stale())
+            conn.close()
+
+        _run_with_server(_run, self.body)
+
+    def test_keep_alive_hints(self):
+        body = ('HTTP/1.1 200 OK\r\nKeep-Alive: timeout=5, max=2\r\n'
+                'Content-Length: 5\r\n\r\nHello')
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            yield From (resp.read())
+            ns = conn.notSock
+            self.assertEqual(ns.idle_timeout, 5)
+            self.assertEqual(ns.requests_left, 2)
+            self.assertAlmostEqual(ns.idle_deadline,
+                                   testLoop.time() + 5 - ns.keep_alive_margin, delta=1)
+            self.assertFalse(ns.is_stale())
+            # retired once the advertised idle timeout is near
+            ns.idle_deadline = testLoop.time()
+            self.assertTrue(ns.is_stale())
+            ns.idle_deadline = None
+            # and when the server will take no more requests
+            ns.keep_alive()
+            ns.keep_alive()
+            self.assertEqual(ns.requests_left, 0)
+            self.assertTrue(ns.is_stale())
+            conn.close()
+
+        _run_with_server(_run, srvr=server.CommandServer([RECEIVE, body, RECEIVE],
+                                                         *CONNECT, verbose=False))
+
+    def test_parse_keep_alive(self):
+        self.assertEqual(client._parse_keep_alive('timeout=5, max=100'),
+                         {'timeout': 5, 'max': 100})
+        self.assertEqual(client._parse_keep_alive('Timeout=3,junk, max=x'),
+                         {'timeout': 3})
+
+    def test_tcp_keepalive(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            ns = yield From (client.create_connection((host, port), 5,
+                                                      tcp_keepalive=(30, 5, 3)))
+            sock = ns.socket()
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 30)
+                self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT), 3)
+            ns.close()
+
+        _run_with_server(_run, '')
+
+
+def _tcp_fastopen_enabled():
+    # client and server TCP Fast Open, per net.ipv4.tcp_fastopen
+    try:
+        with open('/proc/sys/net/ipv4/tcp_fastopen') as f:
+            return int(f.read()) & 3 == 3
+    except (IOError, OSError, ValueError):
+        return False
+
+
+class SocketOptionsTest(TestCase):
+
+    def test_tcp_socket_options(self):
+        options = client.tcp_socket_options(sndbuf=65536, rcvbuf=131072)
+        self.assertIn((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), options)
+        self.assertIn((socket.SOL_SOCKET, socket.SO_SNDBUF, 65536), options)
+        self.assertEqual(client.tcp_socket_options(nodelay=False), [])
+
+    def test_options_set(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            conn.socket_options = client.tcp_socket_options(rcvbuf=65536, quickack=True)
+            yield From (conn.connect())
+            sock = conn.notSock.socket()
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            # Linux doubles the requested size
+            self.assertGreaterEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), 65536)
+            conn.close()
+
+        _run_with_server(_run, '')
+
+    @unittest.skipUnless(_tcp_fastopen_enabled(), 'requires Linux TCP Fast Open')
+    def test_fast_open(self):
+        import struct
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(srv.close)
+        srv.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, 5)
+        srv.bind(('127.0.0.1', 0))
+        srv.listen(5)
+        srv.setblocking(False)
+        TCPI_OPT_SYN_DATA = 32
+
+        @asyncio.coroutine
+        def _request():
+            conn = client.HTTPConnection(*srv.getsockname())
+            conn.fast_open = True
+            yield From (conn.request('GET', '/'))
+            peer, _ = yield From (testLoop.sock_accept(srv))
+            data = yield From (testLoop.sock_recv(peer, 1024))
+            self.assertTrue(data.startswith(b'GET / HTTP/1.1'))
+            info = conn.notSock.socket().getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+            peer.close()
+            conn.close()
+            raise Return (struct.unpack('B', info[5:6])[0] & TCPI_OPT_SYN_DATA)
+
+        @asyncio.coroutine
+        def _run():
+            # the first connection fetches the server's cookie
+            yield From (_request())
+            syn_data = yield From (_request())
+            self.assertTrue(syn_data)
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires Unix sockets')
+class UnixHTTPTest(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'http.sock')
+        self.requests = []
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    @asyncio.coroutine
+    def _serve(self, reader, writer):
+        while True:
+            head = yield From (reader.read(1024))
+            if not head:
+                break
+            self.requests.append(head)
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nHello')
+        writer.close()
+
+    def test_request(self):
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_unix_server(self._serve, self.path, loop=testLoop))
+            conn = client.UnixHTTPConnection(self.path, host='sidecar')
+            for url in ('/one', '/two'):
+                yield From (conn.request('GET', url))
+                resp = yield From (conn.getresponse())
+                d = yield From (resp.read())
+                self.assertEqual(d, b'Hello')
+            conn.close()
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        self.assertEqual(len(self.requests), 2)
+        self.assertIn(b'Host: sidecar\r\n', self.requests[0])
+
+
+class GatherSocket(object):
+    """takes `take` bytes of each sendmsg() call"""
+
+    def __init__(self, take):
+        self.take = take
+        self.calls = []
+
+    def sendmsg(self, parts):
+        self.calls.append([memoryview(p).tobytes() for p in parts])
+        return self.take
+
+
+class GatherWriter(object):
+    """stands in for a StreamWriter on a plain socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.transport = self
+        self.written = []
+
+    def get_extra_info(self, name):
+        return self.sock if name == 'socket' else None
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def write(self, data):
+        self.written.append(memoryview(data).tobytes())
+
+    def writelines(self, parts):
+        for part in parts:
+            self.write(part)
+
+    @asyncio.coroutine
+    def drain(self):
+        pass
+
+
+class ScatterGatherTest(TestCase):
+
+    def _write(self, take, parts):
+        writer = GatherWriter(GatherSocket(take))
+        ns = NotSocket(asyncio.StreamReader(loop=testLoop), writer)
+        testLoop.run_until_complete(ns.writelinesAndDrain(parts))
+        return writer
+
+    def test_one_sendmsg(self):
+        parts = [b'head', bytearray(b'body'), memoryview(b'tail')]
+        writer = self._write(12, parts)
+        self.assertEqual(writer.sock.calls, [[b'head', b'body', b'tail']])
+        self.assertEqual(writer.written, [])
+
+    def test_remainder_buffered(self):
+        writer = self._write(6, [b'head', b'body', b'tail'])
+        self.assertEqual(writer.written, [b'dy', b'tail'])
+
+    def test_request_body_not_joined(self):
+        sent = []
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            # read the whole body, so the server does not close (and
+            # reset) the connection while it is still being sent
+            head = b''
+            while not head.endswith(b'\r\n\r\n'):
+                head += yield From (reader.readline())
+            yield From (reader.readexactly(65536))
+            received.append(head)
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_server(_serve, '127.0.0.1', 0, loop=testLoop))
+            host, port = srvr.sockets[0].getsockname()[:2]
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.connect())
+            original = conn.notSock.writelinesAndDrain
+
+            def writelinesAndDrain(parts):
+                sent.append(parts)
+                return original(parts)
+            conn.notSock.writelinesAndDrain = writelinesAndDrain
+            body = bytearray(b'x' * (conn.mss * 4))
+            yield From (conn.request('POST', '/', body))
+            self.assertIs(sent[0][1], body)
+            resp = yield From (conn.getresponse())
+            yield From (resp.read())
+            conn.close()
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        self.assertIn(b'Content-Length: 65536\r\n', received[0])
+
+
+class SendfileTest(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.data = os.urandom(3 << 20)
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.write(self.data)
+        f.close()
+        self.path = f.name
+        self.addCleanup(os.unlink, self.path)
+
+    def _upload(self, send):
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            while True:
+                d = yield From (reader.read(1 << 16))
+                if not d:
+                    break
+                received.append(d)
+            writer.close()
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_server(_serve, '127.0.0.1', 0, loop=testLoop))
+            host, port = srvr.sockets[0].getsockname()[:2]
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.connect())
+            with open(self.path, 'rb') as f:
+                f.seek(10)
+                yield From (send(conn, f))
+                self.assertEqual(f.tell(), len(self.data))
+            conn.close()
+            yield From (asyncio.sleep(0.1, loop=testLoop))
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        return b''.join(received)
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'requires os.sendfile()')
+    def test_sendfile(self):
+        calls = []
+
+        @asyncio.coroutine
+        def send(conn, f):
+            original = conn.notSock.sendfile
+
+            def sendfile(fileobj):
+                calls.append(fileobj)
+                return original(fileobj)
+            conn.notSock.sendfile = sendfile
+            yield From (conn.send(f))
+
+        self.assertEqual(self._upload(send), self.data[10:])
+        self.assertEqual(len(calls), 1)
+
+    def test_no_mmap_on_loop(self):
+        # without os.sendfile() a regular file is read in the executor,
+        # not mapped and sent from the loop
+        calls = []
+
+        @asyncio.coroutine
+        def send(conn, f):
+            conn.notSock.ssl_object = lambda: object()
+            conn.notSock.sendfile = calls.append
+            yield From (conn.send(f))
+
+        self.assertEqual(self._upload(send), self.data[10:])
+        self.assertEqual(calls, [])
+
+    def test_mmap_fallback(self):
+
+        @asyncio.coroutine
+        def send(conn, f):
+            conn.notSock.ssl_object = lambda: object()
+            sent = yield From (conn.notSock.sendfile(f, blocksize=1 << 16))
+            self.assertEqual(sent, len(self.data) - 10)
+
+        self.assertEqual(self._upload(send), self.data[10:])
+
+    def test_reads_in_executor(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        threads = set()
+        ticks = []
+
+        class SlowFile(io.BytesIO):
+
+            def read(self, size=-1):
+                threads.add(threading.current_thread().name)
+                time.sleep(0.02)
+                return io.BytesIO.read(self, size)
+
+        @asyncio.coroutine
+        def ticker():
+            while True:
+                ticks.append(testLoop.time())
+                yield From (asyncio.sleep(0.005, loop=testLoop))
+
+        @asyncio.coroutine
+        def send(conn, f):
+            conn.executor = executor
+            conn.blocksize = 1 << 18
+            f.seek(10)
+            body = SlowFile(f.read())
+            task = asyncio.Task(ticker(), loop=testLoop)
+            yield From (conn.send(body))
+            task.cancel()
+
+        self.assertEqual(self._upload(send), self.data[10:])
+        self.assertNotIn(threading.current_thread().name, threads)
+        # the loop kept running while the blocks were read
+        self.assertGreater(len(ticks), 10)
+
+    def test_not_regular_file(self):
+        self.assertFalse(client._is_regular_file(io.BytesIO(b'data')))
+        with open(self.path, 'rb') as f:
+            self.assertTrue(client._is_regular_file(f))
+
+
+class ChunkedRequestTest(TestCase):
+
+    def _request(self, body, **kw):
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            data = b''
+            while not data.endswith(b'0\r\n\r\n'):
+                d = yield From (reader.read(1 << 16))
+                if not d:
+                    break
+                data += d
+            received.append(data)
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_server(_serve, '127.0.0.1', 0, loop=testLoop))
+            host, port = srvr.sockets[0].getsockname()[:2]
+            conn = client.HTTPConnection(host, port)
+            for name, value in kw.items():
+                setattr(conn, name, value)
+            yield From (conn.request('POST', '/', body))
+            resp = yield From (conn.getresponse())
+            yield From (resp.read())
+            self.assertEqual(resp.status, 200)
+            conn.close()
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        head, body = received[0].split(b'\r\n\r\n', 1)
+        self.assertIn(b'Transfer-Encoding: chunked', head)
+        self.assertNotIn(b'Content-Length', head)
+        return body
+
+    def test_generator(self):
+        def body():
+            yield b'one'
+            yield b''
+            yield 'two'
+        self.assertEqual(self._request(body()), b'6\r\nonetwo\r\n0\r\n\r\n')
+
+    def test_bytes_not_encoded(self):
+        # bytes-like pieces go as they are; only text is encoded
+        pieces = [b'\xff', bytearray(b'\xfe'), u'\xe9']
+        self.assertEqual(self._request(iter(pieces)), b'3\r\n\xff\xfe\xe9\r\n0\r\n\r\n')
+
+    def test_coalescing(self):
+        pieces = [b'x' * 10] * 5
+        self.assertEqual(self._request(iter(pieces), chunk_size=20),
+                         b'14\r\n' + b'x' * 20 + b'\r\n' +
+                         b'14\r\n' + b'x' * 20 + b'\r\n' +
+                         b'A\r\n' + b'x' * 10 + b'\r\n0\r\n\r\n')
+
+    def test_producer(self):
+        pieces = [b'three', b'two', b'one']
+
+        @asyncio.coroutine
+        def producer():
+            yield From (asyncio.sleep(0, loop=testLoop))
+            raise Return (pieces.pop() if pieces else b'')
+
+        self.assertEqual(self._request(producer), b'B\r\nonetwothree\r\n0\r\n\r\n')
+
+    def test_async_iterator(self):
+        self.assertEqual(self._request(AsyncPieces([b'one', b'two'])),
+                         b'6\r\nonetwo\r\n0\r\n\r\n')
+
+    def test_unsized_file(self):
+        r, w = os.pipe()
+        os.write(w, b'piped')
+        os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            self.assertEqual(self._request(f), b'5\r\npiped\r\n0\r\n\r\n')
+
+
+class ExpectContinueTest(TestCase):
+
+    @asyncio.coroutine
+    def _read_until(self, reader, last):
+        # read lines up to and including `last`
+        data = b''
+        while True:
+            line = yield From (reader.readline())
+            data += line
+            if line in (last, b''):
+                raise Return (data)
+
+    @asyncio.coroutine
+    def _read_chunked(self, reader):
+        body = yield From (self._read_until(reader, b'0\r\n'))
+        body += yield From (reader.readline())
+        raise Return (body)
+
+    def _run(self, serve, requests, continue_timeout=1.0):
+        # send each body through one HTTPConnection, and return each
+        # response's status and body and whether the connection kept its
+        # socket
+        results = []
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_server(serve, '127.0.0.1', 0, loop=testLoop))
+            host, port = srvr.sockets[0].getsockname()[:2]
+            conn = client.HTTPConnection(host, port)
+            conn.continue_timeout = continue_timeout
+            for body in requests:
+                yield From (conn.request('PUT', '/', body, expect_continue=True))
+                resp = yield From (conn.getresponse())
+                data = yield From (resp.read())
+                results.append((resp.status, data, conn.notSock is not None))
+            conn.close()
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        return results
+
+    def test_continue(self):
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            head = yield From (self._read_until(reader, b'\r\n'))
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            body = yield From (reader.readexactly(4))
+            received.append((head, body))
+            writer.write(b'HTTP/1.1 201 Created\r\nContent-Length: 2\r\n\r\nok')
+
+        self.assertEqual(self._run(_serve, [b'data']), [(201, b'ok', True)])
+        head, body = received[0]
+        self.assertIn(b'Expect: 100-continue\r\n', head)
+        self.assertIn(b'Content-Length: 4\r\n', head)
+        self.assertEqual(body, b'data')
+
+    def test_no_answer(self):
+        # a server which ignores the expectation gets the body after the
+        # timeout
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            yield From (self._read_until(reader, b'\r\n'))
+            body = yield From (reader.readexactly(4))
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\n' + body)
+
+        self.assertEqual(self._run(_serve, [b'data'], continue_timeout=0.05),
+                         [(200, b'data', True)])
+
+    def test_early_response(self):
+        received = asyncio.Future(loop=testLoop)
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            yield From (self._read_until(reader, b'\r\n'))
+            writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 3\r\n\r\nbig')
+            received.set_result((yield From (reader.read())))
+
+        # the server is owed the body, so the connection is closed
+        self.assertEqual(self._run(_serve, [b'x' * 100000]), [(413, b'big', False)])
+        # and the body is not sent: the server reads nothing before EOF
+        self.assertEqual(testLoop.run_until_complete(asyncio.wait_for(received, timeout=10)),
+                         b'')
+
+    def test_early_response_chunked(self):
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            yield From (self._read_until(reader, b'\r\n'))
+            writer.write(b'HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n\r\n')
+            received.append((yield From (self._read_chunked(reader))))
+            yield From (self._read_until(reader, b'\r\n'))
+            writer.write(b'HTTP/1.1 102 Processing\r\n\r\nHTTP/1.1 100 Continue\r\n\r\n')
+            received.append((yield From (self._read_chunked(reader))))
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+
+        results = self._run(_serve, [iter([b'secret']), iter([b'secret'])])
+        # the request is ended with an empty body, and the connection reused
+        self.assertEqual(results, [(401, b'', True), (200, b'', True)])
+        self.assertEqual(received, [b'0\r\n\r\n', b'6\r\nsecret\r\n0\r\n\r\n'])
+
+
+class CompressedBodyTest(TestCase):
+
+    def _request(self, body, content_encoding, **kw):
+        # the head the server received, and the body with its transfer
+        # coding undone
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            head = b''
+            while not head.endswith(b'\r\n\r\n'):
+                head += yield From (reader.readline())
+            match = re.search(br'Content-Length: (\d+)', head)
+            if match:
+                body = yield From (reader.readexactly(int(match.group(1))))
+            else:
+                body = b''
+                while 1:
+                    size = int((yield From (reader.readline())), 16)
+                    chunk = yield From (reader.readexactly(size + 2))
+                    if not size:
+                        break
+                    body += chunk[:-2]
+            received.append((head, body))
+            writer.write(b'HTTP/1.1 204 No Content\r\n\r\n')
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_server(_serve, '127.0.0.1', 0, loop=testLoop))
+            host, port = srvr.sockets[0].getsockname()[:2]
+            conn = client.HTTPConnection(host, port)
+            for name, value in kw.items():
+                setattr(conn, name, value)
+            yield From (conn.request('POST', '/', body, content_encoding=content_encoding))
+            resp = yield From (conn.getresponse())
+            yield From (resp.read())
+            self.assertEqual(resp.status, 204)
+            conn.close()
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        return received[0]
+
+    def test_bytes(self):
+        data = b'{"n": 1}\n' * 1000
+        head, body = self._request(data, 'gzip')
+        self.assertIn(b'Content-Encoding: gzip\r\n', head)
+        self.assertIn(('Content-Length: %d\r\n' % len(body)).encode('ascii'), head)
+        self.assertLess(len(body), len(data) // 8)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), data)
+
+    def test_iterable(self):
+        lines = [b'{"n": %d}\n' % n for n in range(1000)]
+        head, body = self._request(iter(lines), 'deflate', blocksize=100)
+        self.assertIn(b'Content-Encoding: deflate\r\n', head)
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', head)
+        self.assertEqual(zlib.decompress(body), b''.join(lines))
+
+    def test_pieces_over_blocksize(self):
+        # pieces longer than blocksize are fed to zlib a block at a time
+        data = os.urandom(10000)
+        for body in (data, bytearray(data), [memoryview(data), b'end']):
+            head, sent = self._request(body, 'gzip', blocksize=4096)
+            self.assertEqual(zlib.decompress(sent, 16 + zlib.MAX_WBITS), data + (
+                b'end' if isinstance(body, list) else b''))
+
+    def test_file_in_executor(self):
+        data = os.urandom(50000)
+        head, body = self._request(io.BytesIO(data), 'gzip', blocksize=4096,
+                                   compress_offload=1)
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', head)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), data)
+
+    def test_connection_loop(self):
+        # the body is read and compressed on the loop the connection runs
+        # on, not the one current when the module was imported
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        asyncio.set_event_loop(loop)
+        self.addCleanup(asyncio.set_event_loop, testLoop)
+        writer = GatherWriter(None)
+        conn = client.HTTPConnection('example.com')
+        conn.notSock = NotSocket(asyncio.StreamReader(loop=loop), writer)
+        conn.compress_offload = 1
+        loop.run_until_complete(conn.request('POST', '/', io.BytesIO(b'data'),
+                                             content_encoding='gzip'))
+        head, body = b''.join(writer.written).split(b'\r\n\r\n', 1)
+        self.assertTrue(head.endswith(b'Content-Encoding: gzip'))
+        self.assertIn(b'\x1f\x8b', body)
+
+    def test_unknown_encoding(self):
+        conn = client.HTTPConnection('example.com')
+        with self.assertRaises(ValueError):
+            testLoop.run_until_complete(
+                conn.request('POST', '/', b'data', content_encoding='br'))
+
+
+class BufferedWriter(GatherWriter):
+    """a GatherWriter whose buffer holds what is written until drained"""
+
+    def __init__(self):
+        GatherWriter.__init__(self, None)
+        self.drains = 0
+        self.limits = None
+
+    def get_write_buffer_size(self):
+        return sum(len(d) for d in self.written)
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (high, low)
+
+    @asyncio.coroutine
+    def drain(self):
+        self.drains += 1
+        del self.written[:]
+
+
+class AsyncPieces(object):
+    """an async iterator over `pieces`"""
+
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+
+    @asyncio.coroutine
+    def __anext__(self):
+        yield From (asyncio.sleep(0, loop=testLoop))
+        if not self.pieces:
+            raise client._StopAsyncIteration()
+        raise Return (self.pieces.pop(0))
+
+
+class BodyProducerTest(TestCase):
+
+    def _conn(self):
+        writer = BufferedWriter()
+        conn = client.HTTPConnection('example.com')
+        conn.notSock = NotSocket(asyncio.StreamReader(loop=testLoop), writer)
+        return conn, writer
+
+    def test_producer(self):
+        conn, writer = self._conn()
+        pieces = [b'three', 'two', b'one']
+
+        @asyncio.coroutine
+        def producer():
+            yield From (asyncio.sleep(0, loop=testLoop))
+            raise Return (pieces.pop() if pieces else None)
+
+        testLoop.run_until_complete(conn.send(producer))
+        self.assertEqual(b''.join(writer.written), b'onetwothree')
+        self.assertEqual(writer.drains, 0)
+
+    def test_bytes_not_encoded(self):
+        # bytes-like pieces go as they are; only text is encoded
+        conn, writer = self._conn()
+        testLoop.run_until_complete(conn.send(AsyncPieces([b'\xff', bytearray(b'\xfe'), u'\xe9'])))
+        self.assertEqual(b''.join(writer.written), b'\xff\xfe\xe9')
+
+    def test_async_iterator(self):
+        conn, writer = self._conn()
+        testLoop.run_until_complete(conn.send(AsyncPieces([b'a', b'', b'b'])))
+        self.assertEqual(b''.join(writer.written), b'ab')
+
+    def test_write_buffer_limits(self):
+        conn, writer = self._conn()
+        conn.write_buffer_high, conn.write_buffer_low = 10, 2
+        testLoop.run_until_complete(conn.send(AsyncPieces([b'x' * 4] * 6)))
+        self.assertEqual(writer.limits, (10, 2))
+        # drained only when more than 10 bytes were buffered
+        self.assertEqual(writer.drains, 2)
+        self.assertEqual(writer.written, [])
+
+
+class RequestTemplateTest(TestCase):
+
+    def _conn(self, host='example.com:8080'):
+        conn = client.HTTPConnection(host)
+        writer = GatherWriter(None)
+        conn.notSock = NotSocket(asyncio.StreamReader(loop=testLoop), writer)
+        return conn, writer
+
+    def _sent(self, conn, writer, coro):
+        testLoop.run_until_complete(coro)
+        conn._HTTPConnection__state = client._CS_IDLE
+        data = b''.join(writer.written)
+        del writer.written[:]
+        return data
+
+    def test_same_as_request(self):
+        conn, writer = self._conn()
+        headers = {'Accept': 'application/json', 'X-Token': 'abc'}
+        expected = self._sent(conn, writer, conn.request('GET', '/rpc', None, headers))
+        template = conn.template('GET', '/rpc', headers)
+        self.assertEqual(self._sent(conn, writer, conn.send_template(template)), expected)
+
+    def test_body(self):
+        conn, writer = self._conn('example.com')
+        template = conn.template('POST', '/rpc')
+        data = self._sent(conn, writer, conn.send_template(template, body='{}'))
+        self.assertEqual(data, b'POST /rpc HTTP/1.1\r\nHost: example.com\r\n'
+                               b'Accept-Encoding: identity\r\nContent-Length: 2\r\n\r\n{}')
+        data = self._sent(conn, writer, conn.send_template(template, body=b'\xff'))
+        self.assertTrue(data.endswith(b'Content-Length: 1\r\n\r\n\xff'))
+
+    def test_substitution(self):
+        conn, writer = self._conn()
+        template = conn.template('GET', '/poll', {'Accept': '*/*'},
+                                 variable_headers=['X-Request-Id'])
+        data = self._sent(conn, writer, conn.send_template(
+            template, path='/poll/7', query='since=5', headers={'x-request-id': 42}))
+        self.assertEqual(data, b'GET /poll/7?since=5 HTTP/1.1\r\nHost: example.com:8080\r\n'
+                               b'Accept-Encoding: identity\r\nAccept: */*\r\n'
+                               b'X-Request-Id: 42\r\n\r\n')
+        self.assertRaises(ValueError, template.render, headers={'X-Other': 'x'})
+
+    def test_round_trip(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            template = conn.template('GET', '/status')
+            for i in range(2):
+                yield From (conn.send_template(template))
+                resp = yield From (conn.getresponse())
+                d = yield From (resp.read())
+                self.assertEqual(d, b'Hello')
+            conn.close()
+
+        body = 'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nHello'
+        srvr = server.CommandServer([RECEIVE, body, RECEIVE, body], *CONNECT, verbose=False)
+        _run_with_server(_run, srvr=srvr)
+        self.assertTrue(srvr.received[0].startswith(b'GET /status HTTP/1.1\r\n'))
+
+
+class PipelineTest(TestCase):
+
+    def test_pipelined_requests(self):
+        body = ('HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\none'
+                'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\ntwo')
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            conn.set_pipelining()
+            yield From (conn.request('GET', '/one'))
+            yield From (conn.request('GET', '/two'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'one')
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'two')
+            conn.close()
+
+        srvr = server.CommandServer([RECEIVE, body, RECEIVE], *CONNECT, verbose=False)
+        _run_with_server(_run, srvr=srvr)
+        # both requests went out in one write
+        self.assertIn(b'GET /one', srvr.received[0])
+        self.assertIn(b'GET /two', srvr.received[0])
+
+    def test_response_before_read(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            conn.set_pipelining()
+            yield From (conn.request('GET', '/one'))
+            yield From (conn.request('GET', '/two'))
+            resp = yield From (conn.getresponse())
+            try:
+                yield From (conn.getresponse())
+            except client.ResponseNotReady:
+                pass
+            else:
+                self.fail('ResponseNotReady not raised')
+            conn.close()
+
+        _run_with_server(_run, 'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\none')
+
+    def test_replay_after_close(self):
+        body = ('HTTP/1.1 200 OK\r\nConnection: close\r\n'
+                'Content-Length: 2\r\n\r\nok')
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            conn.set_pipelining()
+            yield From (conn.request('GET', '/one'))
+            yield From (conn.request('POST', '/two', 'body'))
+            yield From (conn.request('GET', '/three'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'ok')
+            try:
+                yield From (conn.getresponse())
+            except client.PipelineAborted:
+                pass
+            else:
+                self.fail('POST was resent')
+            # the GET was resent on a new connection
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'ok')
+
+        srvr = server.CommandServer([RECEIVE, body], *CONNECT, verbose=False)
+        _run_with_server(_run, srvr=srvr)
+        self.assertIn(b'GET /three', srvr.received[-1])
+        self.assertNotIn(b'POST', srvr.received[-1])
+
+
+class CountingResolver(client.Resolver):
+    """Resolver with a canned, counted getaddrinfo()"""
+
+    def __init__(self, results, **kw):
+        client.Resolver.__init__(self, **kw)
+        self.results = results
+        self.lookups = 0
+
+    @asyncio.coroutine
+    def _getaddrinfo(self, loop, host, port, family):
+        self.lookups += 1
+        yield From (asyncio.sleep(0.01))
+        result = self.results[host]
+        if isinstance(result, Exception):
+            raise result
+        raise Return (socket.getaddrinfo(result, port, family, socket.SOCK_STREAM))
+
+
+class ResolverTest(TestCase):
+
+    def test_cached_until_ttl(self):
+        r = CountingResolver({'a.test': '127.0.0.1'}, ttl=60)
+        infos = testLoop.run_until_complete(r.resolve('a.test', 80))
+        self.assertEqual(infos[0][4], ('127.0.0.1', 80))
+        testLoop.run_until_complete(r.resolve('a.test', 80))
+        self.assertEqual(r.lookups, 1)
+        # a different port is a different entry
+        testLoop.run_until_complete(r.resolve('a.test', 81))
+        self.assertEqual(r.lookups, 2)
+        for key in r._cache:
+            r._cache[key] = (testLoop.time() - 1, r._cache[key][1])
+        testLoop.run_until_complete(r.resolve('a.test', 80))
+        self.assertEqual(r.lookups, 3)
+
+    def test_concurrent_lookups_collapse(self):
+        r = CountingResolver({'a.test': '127.0.0.1'})
+        lookups = [r.resolve('a.test', 80) for i in range(5)]
+        results = testLoop.run_until_complete(asyncio.gather(*lookups))
+        self.assertEqual(r.lookups, 1)
+        self.assertEqual(len(set(str(infos) for infos in results)), 1)
+
+    def test_negative_cache(self):
+        r = CountingResolver({'bad.test': socket.gaierror('no such host')},
+                             negative_ttl=60)
+        for i in range(2):
+            try:
+                testLoop.run_until_complete(r.resolve('bad.test', 80))
+            except socket.gaierror:
+                pass
+            else:
+                self.fail('gaierror not raised')
+        self.assertEqual(r.lookups, 1)
+
+    def test_overrides_and_literals(self):
+        r = CountingResolver({}, overrides={'a.test': ['127.0.0.2']})
+        infos = testLoop.run_until_complete(r.resolve('a.test', 80))
+        self.assertEqual(infos[0][4], ('127.0.0.2', 80))
+        infos = testLoop.run_until_complete(r.resolve('127.0.0.3', 80))
+        self.assertEqual(infos[0][4], ('127.0.0.3', 80))
+        self.assertEqual(r.lookups, 0)
+
+    def test_connection_uses_resolver(self):
+        r = client.Resolver(overrides={'backend.test': ['127.0.0.1']})
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection('backend.test', port, resolver=r)
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'ok')
+            conn.close()
+
+        _run_with_server(_run, 'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+
+class HappyEyeballsTest(TestCase):
+
+    def test_sort_addresses(self):
+        r = client.Resolver()
+        v4 = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.%d' % i, 80))
+              for i in (1, 2)]
+        v6 = [(socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('fe80::%d' % i, 80, 0, 0))
+              for i in (1, 2)]
+        ordered = r.sort_addresses('h.test', 80, v6 + v4)
+        self.assertEqual([a[4][0] for a in ordered],
+                         ['fe80::1', '10.0.0.1', 'fe80::2', '10.0.0.2'])
+        r.connected('h.test', 80, v4[1])
+        ordered = r.sort_addresses('h.test', 80, v6 + v4)
+        self.assertEqual([a[4][0] for a in ordered],
+                         ['10.0.0.2', 'fe80::1', '10.0.0.1', 'fe80::2'])
+        # other ports are unaffected
+        self.assertEqual(r.sort_addresses('h.test', 81, v4), v4)
+
+    def test_unresponsive_address_skipped(self):
+        # connecting to 127.0.0.2 stalls, as to a blackholed address
+        r = client.Resolver(overrides={'multi.test': ['127.0.0.2', '127.0.0.1']})
+        stalled = []
+        connect_sock = client._connect_sock
+
+        @asyncio.coroutine
+        def _connect_sock(loop, addrinfo, source_address=None, **sock_kw):
+            if addrinfo[4][0] == '127.0.0.2':
+                stalled.append(asyncio.Task.current_task(loop=loop))
+                yield From (asyncio.sleep(60))
+            sock = yield From (connect_sock(loop, addrinfo, source_address, **sock_kw))
+            raise Return (sock)
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection('multi.test', port, timeout=10, resolver=r)
+            conn.happy_eyeballs_delay = 0.05
+            started = testLoop.time()
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'ok')
+            self.assertLess(testLoop.time() - started, 5)
+            conn.close()
+
+        client._connect_sock = _connect_sock
+        try:
+            _run_with_server(_run, 'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        finally:
+            client._connect_sock = connect_sock
+        self.assertTrue(stalled[0].cancelled())
+        self.assertEqual(r._preferred[('multi.test', 2222)], ('127.0.0.1', 2222))
+
+    def test_all_addresses_fail(self):
+        r = client.Resolver(overrides={'multi.test': ['127.0.0.1', '127.0.0.2']})
+        try:
+            testLoop.run_until_complete(
+                client.create_connection(('multi.test', 2223), 5, resolver=r,
+                                         happy_eyeballs_delay=0.05))
+        except (socket.error, OSError):
+            pass
+        else:
+            self.fail('connection error not raised')
+
+
+class TLSSessionTest(TestCase):
+
+    def setUp(self):
+        if not hasattr(client, 'HTTPSConnection'):
+            self.skipTest('ssl support required')
+
+    def test_cache_lru(self):
+        cache = client.TLSSessionCache(maxsize=2)
+        cache.put(('a', 443, None), 'session-a')
+        cache.put(('b', 443, None), 'session-b')
+        self.assertEqual(cache.get(('a', 443, None)), 'session-a')
+        cache.put(('c', 443, None), 'session-c')
+        self.assertIsNone(cache.get(('b', 443, None)))
+        self.assertEqual(len(cache), 2)
+        cache.discard(('a', 443, None))
+        self.assertIsNone(cache.get(('a', 443, None)))
+
+    def test_saved_session_offered(self):
+        import ssl
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        cache = client.TLSSessionCache()
+        cache.put(('example.com', 443, context), 'saved-session')
+        offered = []
+
+        @asyncio.coroutine
+        def create_connection(address, timeout=None, source_address=None, **kw):
+            offered.append(kw['ssl'])
+            raise socket.error('not connecting')
+
+        for host, session in (('example.com', 'saved-session'), ('other.com', None)):
+            h = client.HTTPSConnection(host, 443, context=context, session_cache=cache)
+            h._create_connection = create_connection
+            self.assertRaises(socket.error, testLoop.run_until_complete, h.connect())
+            ssl_arg = offered.pop()
+            self.assertIs(getattr(ssl_arg, 'session', None), session)
+            self.assertEqual(ssl_arg.verify_mode, context.verify_mode)
+
+
+class SSLContextCacheTest(TestCase):
+
+    def setUp(self):
+        if not hasattr(client, 'HTTPSConnection'):
+            self.skipTest('ssl support required')
+
+    def test_shared_by_connections(self):
+        a = client.HTTPSConnection('a.example.com')
+        b = client.HTTPSConnection('b.example.com', 8443)
+        self.assertIs(a._context, b._context)
+        self.assertIs(a._context, client.default_context_cache.get())
+
+    def test_keyed_by_settings(self):
+        import ssl
+        cache = client.SSLContextCache()
+        context = cache.get()
+        self.assertIs(cache.get(), context)
+        verifying = cache.get(cert_reqs=ssl.CERT_REQUIRED, cafile=CERT_localhost)
+        self.assertIsNot(verifying, context)
+        self.assertEqual(verifying.verify_mode, ssl.CERT_REQUIRED)
+        self.assertIs(cache.get(cert_reqs=ssl.CERT_REQUIRED, cafile=CERT_localhost),
+                      verifying)
+
+    def test_rebuilt_when_file_changes(self):
+        import ssl
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        cafile = os.path.join(tmpdir, 'ca.pem')
+        shutil.copy(CERT_localhost, cafile)
+        cache = client.SSLContextCache()
+        context = cache.get(cert_reqs=ssl.CERT_REQUIRED, cafile=cafile)
+        self.assertIs(cache.get(cert_reqs=ssl.CERT_REQUIRED, cafile=cafile), context)
+        mtime = os.stat(cafile).st_mtime
+        os.utime(cafile, (mtime + 10, mtime + 10))
+        self.assertIsNot(cache.get(cert_reqs=ssl.CERT_REQUIRED, cafile=cafile), context)
+
+    def test_cert_chain_loaded_once(self):
+
+        class Context(object):
+            loads = 0
+            def load_cert_chain(self, cert_file, key_file=None):
+                self.loads += 1
+
+        cache = client.SSLContextCache()
+        context = Context()
+        cache.load_cert_chain(context, CERT_localhost)
+        cache.load_cert_chain(context, CERT_localhost)
+        self.assertEqual(context.loads, 1)
+        cache.load_cert_chain(context, CERT_fakehostname)
+        self.assertEqual(context.loads, 2)
+
+
+class TunnelRequestTest(TestCase):
+
+    def test_connect_in_one_write(self):
+        reply = 'HTTP/1.0 200 Connection established\r\n\r\n'
+        body = 'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = client.HTTPConnection(host, port)
+            conn.set_tunnel('target.test', 8080, {'Proxy-Authorization': 'Basic eA=='})
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'ok')
+            conn.close()
+
+        srvr = server.CommandServer([RECEIVE, reply, RECEIVE, body], *CONNECT, verbose=False)
+        _run_with_server(_run, srvr=srvr)
+        self.assertEqual(srvr.received[0],
+                         b'CONNECT target.test:8080 HTTP/1.0\r\n'
+                         b'Proxy-Authorization: Basic eA==\r\n\r\n')
+
+    def test_tunnel_before_handshake(self):
+        # create_connection makes the CONNECT exchange on the bare socket
+        reply = 'HTTP/1.1 200 Connection established\r\nVia: proxy\r\n\r\n'
+
+        @asyncio.coroutine
+        def _run(host, port):
+            ns = yield From (client.create_connection(
+                (host, port), 5, tunnel_request=b'CONNECT target.test:443 HTTP/1.0\r\n\r\n'))
+            yield From (ns.writeAndDrain(b'hello'))
+            d = yield From (ns.reader.read(5))
+            self.assertEqual(d, b'tunnl')
+            ns.close()
+
+        srvr = server.CommandServer([RECEIVE, reply, RECEIVE, 'tunnl'], *CONNECT, verbose=False)
+        _run_with_server(_run, srvr=srvr)
+        self.assertEqual(srvr.received[1], b'hello')
+
+    def test_tunnel_refused(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            try:
+                yield From (client.create_connection(
+                    (host, port), 5, tunnel_request=b'CONNECT target.test:443 HTTP/1.0\r\n\r\n'))
+            except OSError as e:
+                self.assertIn('407', str(e))
+            else:
+                self.fail('OSError not raised')
+
+        _run_with_server(_run, 'HTTP/1.0 407 Proxy Authentication Required\r\n\r\n')
+
+
 class TunnelTests(TestCase):
 
     # this test is not quite right. sometimes it works, and sometimes not
@@ -1878,7 +3187,14 @@ def main(verbose=None):
     support.run_unittest(HeaderTests, OfflineTest, BasicTest, #TimeoutTest,
                          #HTTPSTest,
                          RequestBodyTest, SourceAddressTest,
-                         HTTPResponseTest, #ExtendedReadTest,
+                         HTTPResponseTest, KeepAliveTest, PipelineTest, ResolverTest,
+                         HappyEyeballsTest, TLSSessionTest, SSLContextCacheTest,
+                         TunnelRequestTest,
+                         UnixHTTPTest, SourceAddressPoolTest, SocketOptionsTest,
+                         ScatterGatherTest, SendfileTest, ChunkedRequestTest,
+                         BodyProducerTest, RequestTemplateTest,
+                         ExpectContinueTest, CompressedBodyTest,
+                         #ExtendedReadTest,
                          #ExtendedReadTestChunked,
                          TunnelTests)
 
@@ -0,0 +1,251 @@
+import io
+import sys
+import socket
+import trollius as asyncio
+from trollius import From, Return
+
+import unittest
+
+sys.path.insert(0, '..')
+from yieldfrom_t.http import client
+import testtcpserver as server
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+else:
+    from yieldfrom_t.http import http2
+
+TestCase = unittest.TestCase
+
+CONNECT = ('127.0.0.1', 2222)
+testLoop = asyncio.get_event_loop()
+
+
+class H2Server(server.TestTCPServer):
+    """h2c stand-in server; each response body is the request path
+    followed by the request body, padded out with `fill` bytes."""
+
+    def __init__(self, fill=0, host='127.0.0.1', port=2222):
+        self.fill = fill
+        self.connections = 0
+        self.requests = []
+        server.TestTCPServer.__init__(self, host, port)
+
+    def server(self, sock, conn, count):
+        self.connections += 1
+        conn.settimeout(2.0)
+        h2conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False))
+        h2conn.initiate_connection()
+        conn.sendall(h2conn.data_to_send())
+        paths, bodies, pending = {}, {}, []
+        while not self.STOPPED:
+            try:
+                data = conn.recv(65536)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            for event in h2conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    paths[event.stream_id] = headers[b':path']
+                    bodies[event.stream_id] = b''
+                    self.requests.append(headers)
+                elif isinstance(event, h2.events.DataReceived):
+                    bodies[event.stream_id] += event.data
+                    h2conn.acknowledge_received_data(event.flow_controlled_length,
+                                                     event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    body = paths[event.stream_id] + bodies[event.stream_id]
+                    body += b'x' * self.fill
+                    h2conn.send_headers(event.stream_id,
+                                        [(':status', '200'),
+                                         ('content-length', str(len(body))),
+                                         ('x-stream', str(event.stream_id))])
+                    pending.append([event.stream_id, body])
+            # send what the client's flow control windows allow
+            for item in pending[:]:
+                stream_id, body = item
+                while body:
+                    size = min(h2conn.local_flow_control_window(stream_id),
+                               h2conn.max_outbound_frame_size, len(body))
+                    if size <= 0:
+                        break
+                    h2conn.send_data(stream_id, body[:size])
+                    body = body[size:]
+                item[1] = body
+                if not body:
+                    h2conn.end_stream(stream_id)
+                    pending.remove(item)
+            conn.sendall(h2conn.data_to_send())
+        conn.close()
+
+
+def _run_with_server(f, srvr):
+    try:
+        future = f(*CONNECT)
+        testLoop.run_until_complete(asyncio.wait_for(future, timeout=20))
+    finally:
+        srvr.stop()
+
+
+@unittest.skipIf(h2 is None, 'h2 package required')
+class HTTP2ConnectionTest(TestCase):
+
+    def test_multiplexed_requests(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            one = yield From (conn.request('GET', '/one'))
+            two = yield From (conn.request('POST', '/two', b'-body'))
+            self.assertNotEqual(one, two)
+            resp2 = yield From (conn.getresponse(two))
+            resp1 = yield From (conn.getresponse(one))
+            self.assertEqual(resp1.status, 200)
+            self.assertEqual(resp1.version, 20)
+            self.assertEqual(resp2.getheader('x-stream'), str(two))
+            self.assertEqual(resp2.getheader('X-No-Such', 'default'), 'default')
+            d = yield From (resp2.read())
+            self.assertEqual(d, b'/two-body')
+            b = bytearray(2)
+            n = yield From (resp1.readinto(b))
+            self.assertEqual(bytes(b[:n]), b'/o')
+            d = yield From (resp1.read())
+            self.assertEqual(d, b'ne')
+            self.assertTrue(resp1.isclosed())
+            conn.close()
+
+        srvr = H2Server()
+        _run_with_server(_run, srvr)
+        self.assertEqual(srvr.connections, 1)
+        self.assertEqual(srvr.requests[1][b':method'], b'POST')
+        self.assertEqual(srvr.requests[1][b'content-length'], b'5')
+
+    def test_flow_control(self):
+        # both bodies are larger than the default 65535 byte window
+        upload = b'u' * 200000
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            stream_id = yield From (conn.request('PUT', '/big', upload))
+            resp = yield From (conn.getresponse(stream_id))
+            self.assertEqual(resp.length, 4 + len(upload) + 300000)
+            d = yield From (resp.read())
+            self.assertEqual(len(d), resp.length)
+            self.assertTrue(d.startswith(b'/big' + upload))
+            conn.close()
+
+        _run_with_server(_run, H2Server(fill=300000))
+
+    def test_unknown_stream(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            yield From (conn.connect())
+            try:
+                yield From (conn.getresponse(1))
+            except client.ResponseNotReady:
+                pass
+            else:
+                self.fail('ResponseNotReady not raised')
+            conn.close()
+
+        _run_with_server(_run, H2Server())
+
+    def test_readline(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            stream_id = yield From (conn.request('POST', '/lines', b'\none\ntwo'))
+            resp = yield From (conn.getresponse(stream_id))
+            lines = []
+            for _ in range(4):
+                line = yield From (resp.readline())
+                lines.append(line)
+            self.assertEqual(lines, [b'/lines\n', b'one\n', b'two', b''])
+            self.assertTrue(resp.isclosed())
+            conn.close()
+
+        _run_with_server(_run, H2Server())
+
+    def test_file_body(self):
+        upload = b'f' * 100000
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            conn.blocksize = 4096
+            stream_id = yield From (conn.request('PUT', '/file', io.BytesIO(upload)))
+            resp = yield From (conn.getresponse(stream_id))
+            d = yield From (resp.read())
+            self.assertEqual(d, b'/file' + upload)
+            conn.close()
+
+        _run_with_server(_run, H2Server())
+
+    def test_goaway(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            one = yield From (conn.request('GET', '/one'))
+            self.assertTrue(conn.is_usable())
+            event = h2.events.ConnectionTerminated()
+            event.error_code = 0
+            event.last_stream_id = one
+            conn._handle_event(event)
+            self.assertFalse(conn.is_usable())
+            with self.assertRaises(client.NotConnected):
+                yield From (conn.request('GET', '/two'))
+            # the stream the server accepted still completes
+            resp = yield From (conn.getresponse(one))
+            d = yield From (resp.read())
+            self.assertEqual(d, b'/one')
+            conn.close()
+
+        _run_with_server(_run, H2Server())
+
+    def test_unclaimed_streams_bounded(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            conn = http2.HTTP2Connection(host, port, secure=False)
+            conn.max_unclaimed = 2
+            ids = []
+            for path in ('/1', '/2', '/3', '/4'):
+                stream_id = yield From (conn.request('GET', path))
+                ids.append(stream_id)
+            while len(conn._streams) > 2 or not all(
+                    conn._streams[i].ended for i in conn._streams):
+                yield From (asyncio.sleep(0.01, loop=testLoop))
+            for stream_id in ids[:2]:
+                with self.assertRaises(client.ResponseNotReady):
+                    yield From (conn.getresponse(stream_id))
+            resp = yield From (conn.getresponse(ids[3]))
+            d = yield From (resp.read())
+            self.assertEqual(d, b'/4')
+            conn.close()
+
+        _run_with_server(_run, H2Server())
+
+    def test_context_not_changed(self):
+
+        class Context(object):
+            def set_alpn_protocols(self, protocols):
+                raise AssertionError('context changed')
+
+        conn = http2.HTTP2Connection('localhost', context=Context())
+        self.assertIsNotNone(conn._context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import sys
+import trollius as asyncio
+from trollius import From, Return
+
+import unittest
+
+sys.path.insert(0, '..')
+from yieldfrom_t.http import client, limiter
+
+TestCase = unittest.TestCase
+
+testLoop = asyncio.get_event_loop()
+
+
+class ConcurrencyLimiterTest(TestCase):
+
+    def test_fifo_order(self):
+        order = []
+
+        @asyncio.coroutine
+        def worker(lim, name):
+            yield From (lim.acquire())
+            order.append(name)
+            yield From (asyncio.sleep(0.01, loop=testLoop))
+            lim.release()
+
+        @asyncio.coroutine
+        def _run():
+            lim = limiter.ConcurrencyLimiter(1, loop=testLoop)
+            workers = []
+            for n in range(5):
+                workers.append(asyncio.Task(worker(lim, n), loop=testLoop))
+                # let it queue before the next one starts
+                yield From (asyncio.sleep(0, loop=testLoop))
+            yield From (asyncio.wait(workers, loop=testLoop))
+            self.assertEqual(lim.in_use, 0)
+            self.assertEqual(lim.stats['acquired'], 5)
+            self.assertEqual(lim.stats['queued'], 4)
+            self.assertGreater(lim.stats['wait_time'], 0)
+
+        testLoop.run_until_complete(_run())
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+    def test_max_queue(self):
+
+        @asyncio.coroutine
+        def _run():
+            lim = limiter.ConcurrencyLimiter(1, max_queue=1, loop=testLoop)
+            waited = yield From (lim.acquire())
+            self.assertEqual(waited, 0.0)
+            queued = asyncio.Task(lim.acquire(), loop=testLoop)
+            yield From (asyncio.sleep(0, loop=testLoop))
+            with self.assertRaises(limiter.QueueFull):
+                yield From (lim.acquire())
+            self.assertEqual(lim.stats['rejected'], 1)
+            lim.release()
+            waited = yield From (queued)
+            self.assertGreaterEqual(waited, 0.0)
+            self.assertEqual(lim.in_use, 1)
+
+        testLoop.run_until_complete(_run())
+
+    def test_timeout_leaves_queue(self):
+
+        @asyncio.coroutine
+        def _run():
+            lim = limiter.ConcurrencyLimiter(1, loop=testLoop)
+            yield From (lim.acquire())
+            with self.assertRaises(asyncio.TimeoutError):
+                yield From (lim.acquire(timeout=0.01))
+            self.assertEqual(lim.num_waiting, 0)
+            lim.release()
+            self.assertEqual(lim.in_use, 0)
+
+        testLoop.run_until_complete(_run())
+
+
+class AdaptiveLimiterTest(TestCase):
+
+    def _hold(self, lim, n):
+        for _ in range(n):
+            testLoop.run_until_complete(lim.acquire())
+
+    def test_additive_increase(self):
+        lim = limiter.AdaptiveLimiter(2, loop=testLoop)
+        for _ in range(4):
+            self._hold(lim, 2)
+            lim.release(latency=0.01)
+            lim.release(latency=0.01)
+        self.assertEqual(lim.limit, 3)
+        self.assertEqual(lim.stats['increased'], 1)
+
+    def test_no_increase_when_unused(self):
+        lim = limiter.AdaptiveLimiter(4, loop=testLoop)
+        for _ in range(20):
+            self._hold(lim, 1)
+            lim.release(latency=0.01)
+        self.assertEqual(lim.limit, 4)
+
+    def test_backoff_on_status(self):
+        lim = limiter.AdaptiveLimiter(8, loop=testLoop)
+        self._hold(lim, 2)
+        lim.release(latency=1.0, status=client.SERVICE_UNAVAILABLE)
+        self.assertEqual(lim.limit, 4)
+        # once per round trip
+        lim.release(timeout=True)
+        self.assertEqual(lim.limit, 4)
+        lim._last_backoff -= 2
+        self._hold(lim, 1)
+        lim.release(latency=0.01, status=client.TOO_MANY_REQUESTS)
+        self.assertEqual(lim.limit, 2)
+
+    def test_backoff_on_latency(self):
+        lim = limiter.AdaptiveLimiter(8, min_limit=3, loop=testLoop)
+        self._hold(lim, 2)
+        lim.release(latency=0.01)
+        lim.release(latency=0.05)
+        self.assertEqual(lim.limit, 4)
+        lim._last_backoff -= 1
+        self._hold(lim, 1)
+        lim.release(latency=0.05)
+        self.assertEqual(lim.limit, 3)
+
+    def test_unmeasured_release(self):
+        lim = limiter.AdaptiveLimiter(4, loop=testLoop)
+        self._hold(lim, 1)
+        lim.release()
+        self.assertEqual((lim.limit, lim.stats['unmeasured']), (4, 1))
+
+    def test_host_limiter(self):
+        hl = limiter.AdaptiveHostLimiter(limit=4, backoff=0.25, loop=testLoop)
+        testLoop.run_until_complete(hl.acquire('a.test', 80))
+        hl.release('a.test', 80, timeout=True)
+        self.assertEqual(hl.limits(), {('a.test', 80): 1})
+
+
+class HostLimiterTest(TestCase):
+
+    def test_per_host(self):
+
+        @asyncio.coroutine
+        def _run():
+            hl = limiter.HostLimiter(limit=1, loop=testLoop)
+            yield From (hl.acquire('a.test', 80))
+            # another origin is not held up
+            yield From (asyncio.wait_for(hl.acquire('b.test', 80), 1, loop=testLoop))
+            self.assertTrue(hl.limiter_for('a.test', 80).locked())
+            hl.release('a.test', 80)
+            self.assertFalse(hl.limiter_for('a.test', 80).locked())
+            self.assertEqual(hl.stats()[('b.test', 80)]['acquired'], 1)
+
+        testLoop.run_until_complete(_run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import email
+import io
+import os
+import re
+import sys
+import tempfile
+import trollius as asyncio
+from trollius import From, Return
+
+import unittest
+import zlib
+
+sys.path.insert(0, '..')
+from yieldfrom_t.http import client, multipart
+
+TestCase = unittest.TestCase
+
+testLoop = asyncio.get_event_loop()
+
+
+class MultipartBodyTest(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'0123456789' * 10000)
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _request(self, form, **kw):
+        # the head the server received, and the body with its transfer
+        # coding undone
+        received = []
+
+        @asyncio.coroutine
+        def _serve(reader, writer):
+            head = b''
+            while not head.endswith(b'\r\n\r\n'):
+                head += yield From (reader.readline())
+            match = re.search(br'Content-Length: (\d+)', head)
+            if match:
+                body = yield From (reader.readexactly(int(match.group(1))))
+            else:
+                body = b''
+                while 1:
+                    size = int((yield From (reader.readline())), 16)
+                    chunk = yield From (reader.readexactly(size + 2))
+                    if not size:
+                        break
+                    body += chunk[:-2]
+            received.append((head, body))
+            writer.write(b'HTTP/1.1 204 No Content\r\n\r\n')
+
+        @asyncio.coroutine
+        def _run():
+            srvr = yield From (asyncio.start_server(_serve, '127.0.0.1', 0, loop=testLoop))
+            host, port = srvr.sockets[0].getsockname()[:2]
+            conn = client.HTTPConnection(host, port)
+            yield From (conn.request('POST', '/', form, **kw))
+            resp = yield From (conn.getresponse())
+            yield From (resp.read())
+            self.assertEqual(resp.status, 204)
+            conn.close()
+            srvr.close()
+
+        testLoop.run_until_complete(asyncio.wait_for(_run(), timeout=10))
+        return received[0]
+
+    def _fields(self, head, body):
+        content_type = re.search(br'Content-Type: ([^\r]*)', head).group(1)
+        data = b'Content-Type: ' + content_type + b'\r\n\r\n' + body
+        if hasattr(email, 'message_from_bytes'):
+            message = email.message_from_bytes(data)
+        else:
+            message = email.message_from_string(data)   # Python 2
+        return [(part.get_param('name', header='content-disposition'),
+                 part.get_filename(), part.get_payload(decode=True))
+                for part in message.get_payload()]
+
+    def test_sized(self):
+        form = multipart.MultipartBody()
+        form.add_field('title', u'caf\xe9')
+        with open(self.path, 'rb') as f:
+            f.seek(99990)
+            form.add_file('upload', f, filename='digits.txt', content_type='text/plain')
+            form.add_file('pieces', iter([b'one', b'two']), size=6)
+            head, body = self._request(form)
+        self.assertIn(('Content-Length: %d\r\n' % len(form)).encode('ascii'), head)
+        self.assertNotIn(b'Transfer-Encoding', head)
+        self.assertIn(b'Content-Type: multipart/form-data; boundary=' +
+                      form.boundary.encode('ascii') + b'\r\n', head)
+        self.assertEqual(len(body), len(form))
+        self.assertEqual(self._fields(head, body),
+                         [('title', None, u'caf\xe9'.encode('utf-8')),
+                          ('upload', 'digits.txt', b'0123456789'),
+                          ('pieces', 'pieces', b'onetwo')])
+
+    def test_unsized(self):
+        form = multipart.MultipartBody()
+        form.add_field('a', 'b')
+        form.add_file('stream', io.BytesIO(b'streamed'), filename='s.bin')
+        self.assertRaises(TypeError, len, form)
+        head, body = self._request(form)
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', head)
+        self.assertEqual(self._fields(head, body),
+                         [('a', None, b'b'), ('stream', 's.bin', b'streamed')])
+
+    def test_bytes_part(self):
+        # bytes data is sent as it is; only text is encoded
+        form = multipart.MultipartBody('boundary')
+        form.add_part('raw', b'\xff\xfe')
+        form.add_part('text', u'caf\xe9')
+        self.assertEqual(b''.join(b''.join(part) for part in form.body_parts()),
+                         b'--boundary\r\n'
+                         b'Content-Disposition: form-data; name="raw"\r\n\r\n'
+                         b'\xff\xfe\r\n--boundary\r\n'
+                         b'Content-Disposition: form-data; name="text"\r\n\r\n'
+                         b'caf\xc3\xa9\r\n--boundary--\r\n')
+
+    def test_compressed(self):
+        form = multipart.MultipartBody()
+        form.add_field('title', 'digits')
+        with open(self.path, 'rb') as f:
+            form.add_file('upload', f, filename='digits.txt')
+            form.add_file('pieces', iter([b'one', b'two']))
+            head, body = self._request(form, content_encoding='gzip')
+        # the compressed length is not known, so it is sent chunked
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', head)
+        self.assertIn(b'Content-Encoding: gzip\r\n', head)
+        self.assertIn(b'Content-Type: multipart/form-data; boundary=' +
+                      form.boundary.encode('ascii') + b'\r\n', head)
+        self.assertEqual(self._fields(head, zlib.decompress(body, 16 + zlib.MAX_WBITS)),
+                         [('title', None, b'digits'),
+                          ('upload', 'digits.txt', b'0123456789' * 10000),
+                          ('pieces', 'pieces', b'onetwo')])
+
+    def test_quoting(self):
+        form = multipart.MultipartBody('boundary')
+        form.add_field('say "hi"\r\n', b'')
+        self.assertEqual(b''.join(b''.join(part) for part in form.body_parts()),
+                         b'--boundary\r\n'
+                         b'Content-Disposition: form-data; name="say %22hi%22%0D%0A"\r\n\r\n'
+                         b'\r\n--boundary--\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import sys
+import trollius as asyncio
+from trollius import From, Return
+
+import unittest
+
+sys.path.insert(0, '..')
+from yieldfrom_t.http import client, pool
+import testtcpserver as server
+from testtcpserver import RECEIVE
+
+TestCase = unittest.TestCase
+
+CONNECT = ('127.0.0.1', 2222)
+testLoop = asyncio.get_event_loop()
+
+body = 'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nHello'
+
+
+def _run_with_server(f, commands):
+    srvr = server.CommandServer(commands, *CONNECT, verbose=False)
+    try:
+        future = f(*CONNECT)
+        testLoop.run_until_complete(asyncio.wait_for(future, timeout=20))
+    finally:
+        srvr.stop()
+    return srvr
+
+
+class IdleSocket(object):
+    """stands in for an idle NotSocket"""
+
+    def __init__(self):
+        self.closed = False
+
+    def is_stale(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(TestCase):
+
+    def test_reuse_idle_socket(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            p = pool.ConnectionPool(host, port, maxsize=2)
+            conn = yield From (p.acquire())
+            yield From (conn.request('GET', '/one'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'Hello')
+            ns = conn.notSock
+            p.release(conn)
+            self.assertIsNone(conn.notSock)
+            self.assertEqual(p.num_idle, 1)
+
+            conn = yield From (p.acquire())
+            self.assertIs(conn.notSock, ns)
+            self.assertEqual(p.num_idle, 0)
+            yield From (conn.request('GET', '/two'))
+            resp = yield From (conn.getresponse())
+            d = yield From (resp.read())
+            self.assertEqual(d, b'Hello')
+            p.release(conn)
+            p.close()
+            self.assertIsNone(ns.writer)
+
+        _run_with_server(_run, [RECEIVE, body, RECEIVE, body])
+
+    def test_unread_response_not_pooled(self):
+
+        @asyncio.coroutine
+        def _run(host, port):
+            p = pool.ConnectionPool(host, port)
+            conn = yield From (p.acquire())
+            yield From (conn.request('GET', '/'))
+            resp = yield From (conn.getresponse())
+            ns = conn.notSock
+            p.release(conn)
+            self.assertEqual(p.num_connections, 0)
+            resp.close()
+            self.assertIsNone(ns.writer)
+
+        _run_with_server(_run, [RECEIVE, body])
+
+    def test_lifo_order(self):
+        p = pool.ConnectionPool('example.com', maxsize=3, loop=testLoop)
+        first, second = IdleSocket(), IdleSocket()
+        p._idle.append((first, testLoop.time()))
+        p._idle.append((second, testLoop.time()))
+        conn = testLoop.run_until_complete(p.acquire())
+        self.assertIs(conn.notSock, second)
+
+    def test_idle_timeout(self):
+        p = pool.ConnectionPool('example.com', idle_timeout=10, loop=testLoop)
+        old, new = IdleSocket(), IdleSocket()
+        p._idle.append((old, testLoop.time() - 20))
+        p._idle.append((new, testLoop.time()))
+        p.purge()
+        self.assertTrue(old.closed)
+        self.assertFalse(new.closed)
+        self.assertEqual(p.num_idle, 1)
+
+    def test_unix_socket_pool(self):
+        p = pool.ConnectionPool('/run/agent.sock', scheme='http+unix',
+                                unix_host='agent', loop=testLoop)
+        self.assertIsNone(p.port)
+        conn = testLoop.run_until_complete(p.acquire())
+        self.assertIsInstance(conn, client.UnixHTTPConnection)
+        self.assertEqual((conn.path, conn.host), ('/run/agent.sock', 'agent'))
+
+    def test_purge_stale(self):
+        p = pool.ConnectionPool('example.com', loop=testLoop)
+        closed, live = IdleSocket(), IdleSocket()
+        p._idle.append((closed, testLoop.time()))
+        p._idle.append((live, testLoop.time()))
+        closed.closed = True
+        p.purge()
+        self.assertEqual(list(p._idle), [(live, p._idle[0][1])])
+
+    def test_waiters_when_full(self):
+
+        @asyncio.coroutine
+        def _run():
+            p = pool.ConnectionPool('example.com', maxsize=1, loop=testLoop)
+            conn = yield From (p.acquire())
+            waiting = asyncio.ensure_future(p.acquire(), loop=testLoop)
+            yield From (asyncio.sleep(0.01))
+            self.assertFalse(waiting.done())
+            p.release(conn)
+            conn2 = yield From (waiting)
+            self.assertEqual(p.num_connections, 1)
+            try:
+                yield From (p.acquire(timeout=0.01))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                self.fail('acquire() should time out on a full pool')
+
+        testLoop.run_until_complete(_run())
+
+
+    def test_tunnel_reused(self):
+        reply = 'HTTP/1.0 200 Connection established\r\n\r\n'
+
+        @asyncio.coroutine
+        def _run(host, port):
+            m = pool.PoolManager(loop=testLoop)
+            p = m.connection_from_host(host, port, tunnel=('target.test', 80))
+            for path in ('/one', '/two'):
+                conn = yield From (p.acquire())
+                yield From (conn.request('GET', path))
+                resp = yield From (conn.getresponse())
+                d = yield From (resp.read())
+                self.assertEqual(d, b'Hello')
+                p.release(conn)
+            self.assertEqual(p.stats, {'created': 1, 'reused': 1})
+            self.assertEqual(m.tunnel_stats(),
+                             {('http', (host, port), ('target.test', 80)): p.stats})
+            m.close()
+
+        srvr = _run_with_server(_run, [RECEIVE, reply, RECEIVE, body, RECEIVE, body])
+        connects = [r for r in srvr.received if r.startswith(b'CONNECT')]
+        self.assertEqual(len(connects), 1)
+
+
+    def test_wakeup_passed_on(self):
+
+        @asyncio.coroutine
+        def _run():
+            p = pool.ConnectionPool('localhost', 80, maxsize=1, loop=testLoop)
+            conn = yield From (p.acquire())
+            first = asyncio.ensure_future(p.acquire(), loop=testLoop)
+            second = asyncio.ensure_future(p.acquire(), loop=testLoop)
+            yield From (asyncio.sleep(0, loop=testLoop))
+            p.release(conn)
+            # woken, then cancelled before it could take the connection
+            first.cancel()
+            conn = yield From (asyncio.wait_for(second, 1, loop=testLoop))
+            self.assertTrue(first.cancelled())
+            self.assertEqual(p.num_connections, 1)
+
+        testLoop.run_until_complete(_run())
+
+
+class PoolManagerTest(TestCase):
+
+    def test_pool_per_origin(self):
+        m = pool.PoolManager(loop=testLoop)
+        a = m.connection_from_host('example.com')
+        self.assertIs(m.connection_from_host('example.com', 80), a)
+        self.assertIsNot(m.connection_from_host('example.com', 8080), a)
+        self.assertIsNot(m.connection_from_host('example.com',
+                                                tunnel=('target', 443)), a)
+
+    def test_total_limit_evicts_lru(self):
+        m = pool.PoolManager(maxsize=2, maxsize_per_origin=2, loop=testLoop)
+        a = m.connection_from_host('a.example.com')
+        b = m.connection_from_host('b.example.com')
+        older, newer = IdleSocket(), IdleSocket()
+        a._idle.append((older, testLoop.time() - 1))
+        b._idle.append((newer, testLoop.time()))
+
+        c = m.connection_from_host('c.example.com')
+        conn = testLoop.run_until_complete(c.acquire())
+        self.assertTrue(older.closed)
+        self.assertFalse(newer.closed)
+        self.assertEqual(m.num_connections, 2)
+
+    def test_total_limit_waits(self):
+
+        @asyncio.coroutine
+        def _run():
+            m = pool.PoolManager(maxsize=1, loop=testLoop)
+            a = m.connection_from_host('a.example.com')
+            b = m.connection_from_host('b.example.com')
+            conn = yield From (a.acquire())
+            waiting = asyncio.ensure_future(b.acquire(), loop=testLoop)
+            yield From (asyncio.sleep(0.01))
+            self.assertFalse(waiting.done())
+            a.release(conn)
+            yield From (waiting)
+            self.assertEqual(m.num_connections, 1)
+
+        testLoop.run_until_complete(_run())
+
+    def test_blocked_pool_queued_once(self):
+
+        @asyncio.coroutine
+        def _run():
+            m = pool.PoolManager(maxsize=1, loop=testLoop)
+            a = m.connection_from_host('a.example.com')
+            b = m.connection_from_host('b.example.com')
+            conn = yield From (a.acquire())
+            waiting = [asyncio.ensure_future(b.acquire(), loop=testLoop) for _ in range(3)]
+            yield From (asyncio.sleep(0.01, loop=testLoop))
+            self.assertEqual(list(m._blocked), [b])
+            a.release(conn)
+            for _ in range(3):
+                done, pending = yield From (asyncio.wait(waiting, timeout=1, loop=testLoop,
+                                                         return_when=asyncio.FIRST_COMPLETED))
+                self.assertEqual(len(done), 1)
+                waiting = list(pending)
+                b.release(done.pop().result())
+
+        testLoop.run_until_complete(_run())
+
+
+if __name__ == '__main__':
+    unittest.main()
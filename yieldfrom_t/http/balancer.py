@@ -0,0 +1,150 @@
+"""Client-side load balancing for yieldfrom_t.http.client
+
+A LoadBalancer spreads requests over equivalent backends, each with
+its own ConnectionPool, so that a chosen backend's idle keep-alive
+sockets are reused.
+
+    balancer = LoadBalancer([('10.0.0.1', 8080), ('10.0.0.2', 8080)])
+
+    conn = yield From (balancer.acquire())
+    start = balancer.loop.time()
+    try:
+        yield From (conn.request('GET', '/'))
+        resp = yield From (conn.getresponse())
+        body = yield From (resp.read())
+    except (OSError, client.HTTPException):
+        balancer.release(conn, error=True)
+        raise
+    balancer.release(conn, latency=balancer.loop.time() - start,
+                     status=resp.status)
+
+Backends that fail to connect, or answer 5xx, `max_failures` times in
+a row are left out for `eject_time` seconds.
+"""
+from __future__ import print_function
+import trollius as asyncio
+from trollius import From, Return
+import random
+
+from . import pool
+
+__all__ = ["LoadBalancer", "Endpoint"]
+
+
+class Endpoint(object):
+    """One backend, with its requests in flight ('outstanding'), its
+    moving average latency, and its run of failures."""
+
+    def __init__(self, host, port, pool):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = None
+
+    def __repr__(self):
+        return '<%s %s:%s outstanding=%d latency=%r>' % (
+            self.__class__.__name__, self.host, self.port, self.outstanding, self.latency)
+
+    def available(self, now):
+        return self.ejected_until is None or now >= self.ejected_until
+
+    def cost(self, default_latency=1.0):
+        # the expected wait behind the requests already in flight; an
+        # endpoint without a latency sample yet is taken to be typical
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (self.outstanding + 1)
+
+
+class LoadBalancer(object):
+    """Requests spread over `endpoints`, a list of (host, port).
+
+    With strategy 'p2c' (power of two choices) two available endpoints
+    are picked at random and the one with the lower moving average
+    latency times requests in flight is used; with 'least_outstanding'
+    the endpoint with fewest requests in flight is used.  Ties go to an
+    endpoint with an idle connection.  If every endpoint is ejected, all
+    are tried.  Endpoints with no latency sample yet count as having the
+    mean latency of the others, so that without samples 'p2c' picks the
+    one with fewer requests in flight.
+
+    `smoothing` is the weight of each new latency sample in the moving
+    average.  The remaining keyword arguments go to the ConnectionPools,
+    made by `manager` (a PoolManager) if given.
+    """
+
+    strategies = ('p2c', 'least_outstanding')
+
+    def __init__(self, endpoints, scheme='http', strategy='p2c', max_failures=3,
+                 eject_time=30.0, smoothing=0.3, manager=None, loop=None, **pool_kw):
+        if strategy not in self.strategies:
+            raise ValueError("unknown strategy %r" % strategy)
+        if not endpoints:
+            raise ValueError("no endpoints")
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.smoothing = smoothing
+        self.loop = loop or asyncio.get_event_loop()
+        self.random = random.Random()
+        self.endpoints = []
+        for host, port in endpoints:
+            if manager is not None:
+                p = manager.connection_from_host(host, port, scheme=scheme)
+            else:
+                p = pool.ConnectionPool(host, port, scheme=scheme, loop=self.loop, **pool_kw)
+            self.endpoints.append(Endpoint(host, port, p))
+        # connections handed out, and their endpoints
+        self._in_use = {}
+
+    def choose(self):
+        """Return the Endpoint for the next request."""
+        now = self.loop.time()
+        candidates = [e for e in self.endpoints if e.available(now)] or self.endpoints
+        if self.strategy == 'p2c' and len(candidates) > 2:
+            candidates = self.random.sample(candidates, 2)
+        if self.strategy == 'least_outstanding':
+            key = lambda e: (e.outstanding, not e.pool.num_idle, e.latency or 0.0)
+        else:
+            known = [e.latency for e in self.endpoints if e.latency is not None]
+            default = sum(known) / len(known) if known else 1.0
+            key = lambda e: (e.cost(default), e.outstanding, not e.pool.num_idle)
+        return min(candidates, key=key)
+
+    @asyncio.coroutine
+    def acquire(self, timeout=None):
+        """Return an HTTPConnection to the chosen endpoint, on an idle
+        socket if it has one.  Give it back with release()."""
+        endpoint = self.choose()
+        conn = yield From (endpoint.pool.acquire(timeout))
+        endpoint.outstanding += 1
+        self._in_use[conn] = endpoint
+        raise Return (conn)
+
+    def release(self, conn, latency=None, status=None, error=False):
+        """Give back a connection from acquire(), with the outcome of its
+        request: its latency in seconds, the response status, and whether
+        it failed (to connect, or otherwise) before a response came."""
+        endpoint = self._in_use.pop(conn)
+        endpoint.outstanding -= 1
+        if error:
+            conn.close()
+        endpoint.pool.release(conn)
+        if latency is not None:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.smoothing * (latency - endpoint.latency)
+        if error or (status is not None and status >= 500):
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                endpoint.ejected_until = self.loop.time() + self.eject_time
+        elif status is not None:
+            endpoint.failures = 0
+            endpoint.ejected_until = None
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.pool.close()
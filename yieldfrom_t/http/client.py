@@ -56,6 +56,11 @@ Note: this enforcement is applied by the HTTPConnection class. The
       requests cannot be placed into the pipeline until it is known that
       the server will NOT be closing the connection.
 
+      HTTPConnection.set_pipelining() relaxes the state machine for
+      clients that accept that risk: requests may then be made without
+      waiting for the earlier responses, and getresponse() returns the
+      responses in request order.
+
 Logical State                  __state            __response
 -------------                  -------            ----------
 Idle                           _CS_IDLE           None
@@ -71,21 +76,27 @@ from trollius import From, Return
 import email.parser
 import email.message
 import io
+import mmap
 import os
 import socket
+import stat
 import collections
+import errno
 import sys
+import weakref
+import zlib
 try:
     from urllib.parse import urlsplit
 except ImportError:
     from urlparse import urlsplit
 
-__all__ = ["HTTPResponse", "HTTPConnection",
+__all__ = ["HTTPResponse", "HTTPConnection", "UnixHTTPConnection", "RequestTemplate",
            "HTTPException", "NotConnected", "UnknownProtocol",
            "UnknownTransferEncoding", "UnimplementedFileMode",
            "IncompleteRead", "InvalidURL", "ImproperConnectionState",
            "CannotSendRequest", "CannotSendHeader", "ResponseNotReady",
-           "BadStatusLine", "error", "responses"]
+           "BadStatusLine", "PipelineAborted", "SourceAddressPool", "error",
+           "responses"]
 
 HTTP_PORT = 80
 HTTPS_PORT = 443
@@ -97,6 +108,10 @@ _CS_IDLE = 'Idle'
 _CS_REQ_STARTED = 'Request-started'
 _CS_REQ_SENT = 'Request-sent'
 
+# methods which may be sent again if the connection closes before the
+# response arrives (RFC 7230, section 6.3.1)
+_IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+
 # status codes
 # informational
 CONTINUE = 100
@@ -221,6 +236,35 @@ MAXAMOUNT = 1048576
 _MAXLINE = 65536
 _MAXHEADERS = 100
 
+# request bodies written as they are, without reading or encoding
+_BYTES_LIKE = (bytes, bytearray, memoryview)
+
+# the high water mark of asyncio's transports, unless set otherwise
+_DEFAULT_WRITE_HIGH = 64 * 1024
+
+# errors of a non-blocking send that is to be tried again; Python 2 has
+# no BlockingIOError or InterruptedError to catch
+_TRY_AGAIN = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def _byte_view(data):
+    # a view of a bytes-like object that is sliced and sized in bytes
+    view = memoryview(data)
+    if hasattr(view, 'cast'):
+        return view.cast('B')
+    # Python 2: its memoryview cannot be cast, and is not taken by
+    # everything that takes bytes, so slice the object itself
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    return view.tobytes()
+
+try:
+    _StopAsyncIteration = StopAsyncIteration
+except NameError:
+    # before Python 3.5
+    class _StopAsyncIteration(Exception):
+        pass
+
 
 class NotSocket():
     
@@ -234,21 +278,544 @@ class NotSocket():
         self.readline = self.reader.readline
 
         self.transportRefCt = 1
+        # cleared when a response is abandoned before its body is read
+        self.reusable = True
+
+        # from the server's Keep-Alive header: its idle timeout, the loop
+        # time by which to stop reusing the connection, and the number of
+        # further requests it will accept
+        self._loop = asyncio.get_event_loop()
+        self.idle_timeout = None
+        self.idle_deadline = None
+        self.requests_left = None
+
+    # seconds before the server's idle timeout at which the connection is
+    # retired, rather than racing the server closing it
+    keep_alive_margin = 1.0
+
+    # the transport's write buffer limits, when set by set_write_limits()
+    write_high = None
+    write_low = None
 
     @asyncio.coroutine
     def writeAndDrain(self, data):
         self.writer.write(data)
         yield From (self.writer.drain())
+
+    def set_write_limits(self, high=None, low=None):
+        """Set the high and low water marks of the transport's write
+        buffer; None for the transport's defaults."""
+        self.write_high = high
+        self.write_low = low
+        self.writer.transport.set_write_buffer_limits(high, low)
+
+    @asyncio.coroutine
+    def writeBuffered(self, data):
+        """Write `data`, waiting only if the write buffer is above its
+        high water mark, until it falls below the low one."""
+        self.writer.write(data)
+        yield From (self._drain_if_full())
+
+    @asyncio.coroutine
+    def _drain_if_full(self):
+        high = self.write_high
+        if high is None:
+            high = _DEFAULT_WRITE_HIGH
+        if self.writer.transport.get_write_buffer_size() > high:
+            yield From (self.writer.drain())
+
+    # most buffers passed to one sendmsg() call; below any system's IOV_MAX
+    max_gather = 64
+
+    @asyncio.coroutine
+    def writelinesAndDrain(self, parts):
+        """Write a list of bytes-like objects as one gathered write.
+
+        On a plain socket with nothing already buffered in the transport,
+        the parts go to sendmsg() directly, so that they leave in the
+        same segments without being joined into a new bytes object; what
+        the kernel does not take is buffered by the transport as usual.
+        """
+        sock = self.writer.transport.get_extra_info('socket')
+        if (len(parts) > 1 and len(parts) <= self.max_gather and
+                hasattr(sock, 'sendmsg') and self.ssl_object() is None and
+                self.writer.transport.get_write_buffer_size() == 0):
+            try:
+                sent = sock.sendmsg(parts)
+            except socket.error as e:
+                if e.errno not in _TRY_AGAIN:
+                    raise
+                sent = 0
+            for part in parts:
+                if sent:
+                    view = _byte_view(part)
+                    if sent >= len(view):
+                        sent -= len(view)
+                        continue
+                    part = view[sent:]
+                    sent = 0
+                self.writer.write(part)
+        else:
+            self.writer.writelines(parts)
+        yield From (self._drain_if_full())
         
+    @asyncio.coroutine
+    def drainAll(self):
+        """Wait until the transport has written everything buffered."""
+        transport = self.writer.transport
+        if transport.get_write_buffer_size():
+            # drain() returns once the buffer is below the low-water mark
+            transport.set_write_buffer_limits(high=0)
+            try:
+                yield From (self.writer.drain())
+            finally:
+                transport.set_write_buffer_limits(self.write_high, self.write_low)
+
+    @asyncio.coroutine
+    def sendfile(self, fileobj, blocksize=1 << 20):
+        """Send a regular file from its current position to its end,
+        with os.sendfile() on a plain socket, or else from an mmap of it.
+
+        Either way the data goes from the page cache without being read
+        into Python objects block by block, but an mmap's page faults
+        are taken on the loop; HTTPConnection.send() only uses this when
+        can_sendfile() is True.  The file is left positioned at its end;
+        the number of bytes sent is returned.
+        """
+        fd = fileobj.fileno()
+        offset = fileobj.tell()
+        size = os.fstat(fd).st_size
+        if offset >= size:
+            raise Return (0)
+        if self.can_sendfile():
+            sent = yield From (self._sendfile(fd, offset, size))
+        else:
+            sent = yield From (self._send_mmap(fd, offset, size, blocksize))
+        fileobj.seek(offset + sent)
+        raise Return (sent)
+
+    def can_sendfile(self):
+        """True if sendfile() can hand files to os.sendfile(): a plain
+        socket, where there is one."""
+        return hasattr(os, 'sendfile') and self.ssl_object() is None
+
+    @asyncio.coroutine
+    def _sendfile(self, fd, offset, size):
+        # the transport's buffer must be empty, so that nothing it holds
+        # is overtaken, and so that it is not itself waiting on the socket
+        yield From (self.drainAll())
+        sockfd = self.socket().fileno()
+        start = offset
+        while offset < size:
+            try:
+                sent = os.sendfile(sockfd, fd, offset, size - offset)
+            except (OSError, socket.error) as e:
+                if e.errno not in _TRY_AGAIN:
+                    raise
+                writable = asyncio.Future(loop=self._loop)
+                self._loop.add_writer(sockfd, lambda: writable.done() or writable.set_result(None))
+                try:
+                    yield From (writable)
+                finally:
+                    self._loop.remove_writer(sockfd)
+                continue
+            if not sent:
+                break   # truncated while being sent
+            offset += sent
+        raise Return (offset - start)
+
+    @asyncio.coroutine
+    def _send_mmap(self, fd, offset, size, blocksize):
+        mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(mapped)
+        except TypeError:
+            # Python 2 cannot view an mmap; its slices are copies
+            view = mapped
+        try:
+            for start in range(offset, size, blocksize):
+                yield From (self.writeBuffered(view[start:start + blocksize]))
+            # the transport may hold on to slices of the map until written
+            yield From (self.drainAll())
+        finally:
+            if view is not mapped:
+                view.release()
+            try:
+                mapped.close()
+            except BufferError:
+                pass   # still exported; closed when collected
+        raise Return (size - offset)
+
     def close(self):
         self.transportRefCt -= 1
         if self.transportRefCt < 1:
             self.writer.transport.close()
             self.reader = self.writer = None
-        
+
+    def is_stale(self):
+        """True if this idle connection cannot carry another request.
+
+        Between requests nothing should be waiting in the reader; EOF or
+        stray bytes mean the server has closed (or half-closed) its end
+        or the stream is out of sync.
+        """
+        if not self.reusable or self.reader is None or self.writer is None:
+            return True
+        transport = self.writer.transport
+        is_closing = getattr(transport, 'is_closing', None)
+        if is_closing is not None:
+            if is_closing():
+                return True
+        elif getattr(transport, '_closing', False) or getattr(transport, '_closed', False):
+            return True
+        if self.reader.exception() is not None:
+            return True
+        if self.requests_left is not None and self.requests_left < 1:
+            return True
+        if self.idle_deadline is not None and self._loop.time() >= self.idle_deadline:
+            return True
+        return bool(self.reader._eof or self.reader._buffer)
+
+    def keep_alive(self, value=None):
+        """Note a response received, with its Keep-Alive header value if any.
+
+        'timeout=5, max=100' says the server closes the connection after
+        5 idle seconds, and takes 100 more requests on it.
+        """
+        params = _parse_keep_alive(value) if value else {}
+        if 'timeout' in params:
+            self.idle_timeout = params['timeout']
+        if 'max' in params:
+            self.requests_left = params['max']
+        elif self.requests_left is not None:
+            self.requests_left -= 1
+        if self.idle_timeout is not None:
+            self.idle_deadline = self._loop.time() + self.idle_timeout - self.keep_alive_margin
+
+    @asyncio.coroutine
+    def peekline(self, timeout=None):
+        """Wait up to `timeout` seconds for a line to arrive, and return
+        it without consuming it; None if none came in time.  At EOF the
+        partial line (perhaps b'') is returned."""
+        reader = self.reader
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while b'\n' not in reader._buffer:
+            if reader._eof:
+                raise Return (bytes(reader._buffer))
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    raise Return (None)
+            # unlike a cancelled readline(), a cancelled wait for data
+            # loses nothing from the buffer
+            waiter = asyncio.ensure_future(reader._wait_for_data('peekline'), loop=self._loop)
+            done, pending = yield From (asyncio.wait([waiter], timeout=remaining, loop=self._loop))
+            if pending:
+                waiter.cancel()
+                yield From (asyncio.wait([waiter], loop=self._loop))
+                raise Return (None)
+            waiter.result()
+        line_end = reader._buffer.index(b'\n') + 1
+        raise Return (bytes(reader._buffer[:line_end]))
+
     def socket(self):
         return self.writer.transport.get_extra_info('socket')
 
+    def ssl_object(self):
+        """The SSLSocket or SSLObject of a TLS transport, else None."""
+        transport = self.writer.transport
+        ssl_object = transport.get_extra_info('ssl_object')
+        if ssl_object is None and transport.get_extra_info('sslcontext') is not None:
+            ssl_object = transport.get_extra_info('socket')
+        return ssl_object
+
+
+def _is_regular_file(fileobj):
+    """True if `fileobj` is an open regular file, which can be sent
+    with NotSocket.sendfile()."""
+    try:
+        fd = fileobj.fileno()
+        fileobj.tell()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return False
+    return stat.S_ISREG(os.fstat(fd).st_mode)
+
+
+def _body_length(body):
+    """The length of a request body: its len(), or for a regular file the
+    bytes from its position to its end; None if it cannot be found."""
+    try:
+        return len(body)
+    except TypeError:
+        pass
+    # If this is a regular file, try to fstat its file descriptor
+    try:
+        st = os.fstat(body.fileno())
+        if stat.S_ISREG(st.st_mode):
+            return max(st.st_size - body.tell(), 0)
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+def _is_producer(body):
+    """True for a body whose pieces come from coroutines: a producer
+    function, or an async iterator."""
+    return hasattr(body, '__anext__') or (callable(body) and not hasattr(body, 'read'))
+
+
+@asyncio.coroutine
+def _next_piece(body):
+    """The next piece of a producer or async iterator body, or None at
+    the end."""
+    if hasattr(body, '__anext__'):
+        try:
+            piece = yield From (body.__anext__())
+        except _StopAsyncIteration:
+            raise Return (None)
+        raise Return (piece if piece is not None else b'')
+    piece = yield From (body())
+    raise Return (piece or None)
+
+
+def _header_line(header, values):
+    """A header line, without its \\r\\n, as bytes."""
+    if hasattr(header, 'encode'):
+        header = header.encode('ascii')
+    values = list(values)
+    for i, one_value in enumerate(values):
+        if hasattr(one_value, 'encode'):
+            values[i] = one_value.encode('latin-1')
+        elif isinstance(one_value, int):
+            values[i] = str(one_value).encode('ascii')
+    value = b'\r\n\t'.join(values)
+    return header + b': ' + value
+
+
+class RequestTemplate(object):
+    """The head of a request, serialized to bytes once, for requests
+    made again and again with HTTPConnection.send_template().
+
+    Made by HTTPConnection.template().  Each request may have its own
+    path, query and values of the variable headers; the rest of the head
+    is written as it is.
+    """
+
+    def __init__(self, method, path, header_lines, variable_headers=(),
+                 http_vsn_str='HTTP/1.1'):
+        self.method = method
+        self.path = _to_ascii(path)
+        self._start = ('%s ' % method).encode('ascii')
+        self._rest = b''.join([(' %s' % http_vsn_str).encode('ascii')] +
+                              [b'\r\n' + line for line in header_lines] + [b'\r\n'])
+        self._variable = dict((name.lower(), name.encode('ascii') + b': ')
+                              for name in variable_headers)
+
+    def __repr__(self):
+        return '<%s %s %s>' % (self.__class__.__name__, self.method,
+                               self.path.decode('ascii'))
+
+    def render(self, path=None, query=None, headers=None, body=None):
+        """Return the request, as a list of bytes-like parts."""
+        parts = [self._start, _to_ascii(path) if path else self.path]
+        if query:
+            parts.extend((b'?', _to_ascii(query)))
+        parts.append(self._rest)
+        if headers:
+            for name, value in headers.items():
+                try:
+                    prefix = self._variable[name.lower()]
+                except KeyError:
+                    raise ValueError("%r is not a variable header of %r" % (name, self))
+                if hasattr(value, 'encode'):
+                    value = value.encode('latin-1')
+                elif isinstance(value, int):
+                    value = str(value).encode('ascii')
+                parts.extend((prefix, value, b'\r\n'))
+        if body is not None:
+            parts.append(('Content-Length: %d\r\n' % len(body)).encode('ascii'))
+        parts.append(b'\r\n')
+        if body:
+            parts.append(body)
+        return parts
+
+
+def _to_ascii(s):
+    return s.encode('ascii') if hasattr(s, 'encode') else s
+
+
+class _ChunkedWriter(object):
+    """Writes the pieces of a request body to a NotSocket as chunks.
+
+    Pieces are coalesced until there are `chunk_size` bytes, and each
+    chunk is written in one gathered write; `head`, the request head,
+    goes with the first.
+    """
+
+    def __init__(self, notSock, chunk_size, head=None):
+        self.notSock = notSock
+        self.chunk_size = chunk_size
+        self.parts = [head] if head else []
+        self.chunk = []
+        self.size = 0
+
+    @asyncio.coroutine
+    def write(self, piece):
+        if not isinstance(piece, _BYTES_LIKE):
+            piece = piece.encode("iso-8859-1")
+        if piece:
+            self.chunk.append(piece)
+            self.size += len(piece)
+            if self.size >= self.chunk_size:
+                self._end_chunk()
+                yield From (self._flush())
+
+    @asyncio.coroutine
+    def close(self):
+        """Write what is left, and the last (empty) chunk."""
+        self._end_chunk()
+        self.parts.append(b"0\r\n\r\n")
+        yield From (self._flush())
+
+    def _end_chunk(self):
+        if self.size:
+            self.parts.append(("%X\r\n" % self.size).encode("ascii"))
+            self.parts.extend(self.chunk)
+            self.parts.append(b"\r\n")
+            self.chunk = []
+            self.size = 0
+
+    @asyncio.coroutine
+    def _flush(self):
+        parts, self.parts = self.parts, []
+        yield From (self.notSock.writelinesAndDrain(parts))
+
+
+def _compressor(encoding, level=-1):
+    """A zlib compressobj for Content-Encoding `encoding`."""
+    if encoding == 'gzip':
+        wbits = 16 + zlib.MAX_WBITS
+    elif encoding == 'deflate':
+        # HTTP's deflate is the zlib format (RFC 7230, section 4.2.2)
+        wbits = zlib.MAX_WBITS
+    else:
+        raise ValueError("unsupported content encoding %r" % (encoding,))
+    return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+
+class _CompressedBody(object):
+    """A producer of the pieces of a request body compressed with
+    `compressor`, for a Content-Encoding.
+
+    The body may be bytes-like, a file-like object, an iterable of
+    pieces (a list included), a producer or async iterator, or an object
+    with a body_parts() method, whose parts may be any of those; text
+    pieces are encoded as ISO-8859-1.  It is fed through zlib at most
+    `blocksize` bytes at a time; file-like bodies are read, and pieces of
+    at least `offload` bytes are compressed, in `executor` (None for the
+    loop's default).  With offload None all compression is done on the
+    loop.
+    """
+
+    def __init__(self, body, compressor, loop, executor=None, blocksize=1 << 18,
+                 offload=None):
+        # the parts of a multipart body, each read in turn as the body
+        self._parts = None
+        if hasattr(body, 'body_parts'):
+            self._parts = body.body_parts()
+            self.body = self._next_part()
+        else:
+            self.body = self._source(body)
+        self.compressor = compressor
+        self.loop = loop
+        self.executor = executor
+        self.blocksize = blocksize
+        self.offload = offload
+        self._pending = None
+        self._done = False
+
+    @staticmethod
+    def _source(body):
+        # body as something _read() takes pieces from
+        if isinstance(body, _BYTES_LIKE):
+            body = [body]
+        if not hasattr(body, 'read') and not _is_producer(body):
+            body = iter(body)
+        return body
+
+    def _next_part(self):
+        part = next(self._parts, None)
+        return None if part is None else self._source(part)
+
+    @asyncio.coroutine
+    def _read(self):
+        # the next piece of the body, or None at its end
+        piece = None
+        if self._pending is not None:
+            piece, self._pending = self._pending, None
+        while piece is None and self.body is not None:
+            if hasattr(self.body, 'read'):
+                piece = yield From (self.loop.run_in_executor(
+                    self.executor, self.body.read, self.blocksize))
+                piece = piece or None
+            elif _is_producer(self.body):
+                piece = yield From (_next_piece(self.body))
+            else:
+                piece = next(self.body, None)
+            if piece is None:
+                # the end of the body, or of a part of a multipart body
+                self.body = self._next_part() if self._parts is not None else None
+        if piece is not None and not isinstance(piece, _BYTES_LIKE):
+            piece = piece.encode("iso-8859-1")
+        if piece is not None and len(piece) > self.blocksize:
+            view = _byte_view(piece)
+            piece, self._pending = view[:self.blocksize], view[self.blocksize:]
+        if piece is not None and not isinstance(piece, bytes) and not hasattr(memoryview, 'cast'):
+            # Python 2's zlib takes neither bytearrays nor memoryviews
+            piece = memoryview(piece).tobytes()
+        raise Return (piece)
+
+    @asyncio.coroutine
+    def __call__(self):
+        while not self._done:
+            piece = yield From (self._read())
+            if piece is None:
+                self._done = True
+                raise Return (self.compressor.flush())
+            if self.offload is not None and len(piece) >= self.offload:
+                # zlib lets go of the GIL while it works
+                out = yield From (self.loop.run_in_executor(
+                    self.executor, self.compressor.compress, piece))
+            else:
+                out = self.compressor.compress(piece)
+            if out:
+                raise Return (out)
+        raise Return (b'')
+
+    @asyncio.coroutine
+    def read_all(self):
+        """The whole compressed body, as bytes."""
+        pieces = []
+        while 1:
+            piece = yield From (self())
+            if not piece:
+                break
+            pieces.append(piece)
+        raise Return (b''.join(pieces))
+
+
+def _parse_keep_alive(value):
+    """Parse a Keep-Alive header value into a dict of its numeric parameters."""
+    params = {}
+    for part in value.split(','):
+        name, sep, number = part.partition('=')
+        try:
+            params[name.strip().lower()] = int(number.strip())
+        except ValueError:
+            pass
+    return params
+
 
 class HTTPMessage(email.message.Message):
     # XXX The only usage of this method is in
@@ -531,6 +1098,9 @@ class HTTPResponse(io.IOBase): #io.BufferedIOBase):
     def close(self):
         super(HTTPResponse, self).close() # set "closed" flag
         if self.fp:
+            # the body was not read to the end, so whatever is left of it
+            # would be mistaken for the next response on this socket
+            self.fp.reusable = False
             self._close_conn()
 
     # These implementations are for the benefit of io.BufferedReader.
@@ -940,28 +1510,453 @@ class HTTPResponse(io.IOBase): #io.BufferedIOBase):
     def getcode(self):
         return self.status
 
+def _numeric_addrinfo(host, port, family=0):
+    """getaddrinfo() for an IP address literal; None for a hostname."""
+    try:
+        return socket.getaddrinfo(host, port, family, socket.SOCK_STREAM, 0,
+                                  socket.AI_NUMERICHOST)
+    except socket.gaierror:
+        return None
+
+
+class Resolver(object):
+    """Caching name lookups for create_connection().
+
+    Address lists are kept per (host, port, family) for `ttl` seconds,
+    and failed lookups for `negative_ttl` seconds.  Concurrent lookups
+    of the same name share one getaddrinfo() call in the executor.
+    `overrides` maps host names to lists of IP addresses, which are
+    used instead of looking the names up, as with a hosts file.
+
+    The resolver also remembers which address last connected for each
+    (host, port), and sort_addresses() tries that address, and then its
+    address family, first.
+    """
+
+    def __init__(self, ttl=60.0, negative_ttl=5.0, overrides=None, maxsize=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.overrides = dict(overrides or {})
+        self.maxsize = maxsize
+        # (host, port, family) -> (expiry time, addrinfo list or exception)
+        self._cache = {}
+        self._pending = {}
+        # (host, port) -> sockaddr of the last successful connection
+        self._preferred = {}
+
+    def clear(self):
+        self._cache.clear()
+        self._preferred.clear()
+
+    def sort_addresses(self, host, port, infos):
+        """Order addresses for connecting: the last winner first, and then
+        alternating between address families, starting with its family."""
+        infos = list(infos)
+        preferred = self._preferred.get((host, port))
+        for i, addrinfo in enumerate(infos):
+            if addrinfo[4] == preferred:
+                infos.insert(0, infos.pop(i))
+                break
+        families = []
+        by_family = {}
+        for addrinfo in infos:
+            if addrinfo[0] not in by_family:
+                families.append(addrinfo[0])
+                by_family[addrinfo[0]] = collections.deque()
+            by_family[addrinfo[0]].append(addrinfo)
+        ordered = []
+        while len(ordered) < len(infos):
+            for family in families:
+                if by_family[family]:
+                    ordered.append(by_family[family].popleft())
+        return ordered
+
+    def connected(self, host, port, addrinfo):
+        """Note that `addrinfo` was the address that connected for host, port."""
+        self._preferred[(host, port)] = addrinfo[4]
+
+    @asyncio.coroutine
+    def resolve(self, host, port, family=0, loop=None):
+        """Return the getaddrinfo() list of stream addresses for host, port."""
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        if host in self.overrides:
+            infos = []
+            for address in self.overrides[host]:
+                infos.extend(_numeric_addrinfo(address, port, family) or [])
+            raise Return (infos)
+        infos = _numeric_addrinfo(host, port, family)
+        if infos is not None:
+            raise Return (infos)
+
+        key = (host, port, family)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires, result = entry
+            if expires > loop.time():
+                if isinstance(result, Exception):
+                    raise result
+                raise Return (result)
+            del self._cache[key]
+
+        lookup = self._pending.get(key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._lookup(key, loop), loop=loop)
+            self._pending[key] = lookup
+        # shielded, so that one caller giving up does not cancel the
+        # lookup for the others
+        infos = yield From (asyncio.shield(lookup, loop=loop))
+        raise Return (infos)
+
+    @asyncio.coroutine
+    def _lookup(self, key, loop):
+        host, port, family = key
+        try:
+            infos = yield From (self._getaddrinfo(loop, host, port, family))
+            if not infos:
+                raise socket.gaierror('getaddrinfo() returned empty list')
+        except socket.gaierror as e:
+            self._store(key, loop.time() + self.negative_ttl, e)
+            raise
+        finally:
+            del self._pending[key]
+        self._store(key, loop.time() + self.ttl, infos)
+        raise Return (infos)
+
+    def _getaddrinfo(self, loop, host, port, family):
+        return loop.getaddrinfo(host, port, family=family, type=socket.SOCK_STREAM)
+
+    def _store(self, key, expires, result):
+        if len(self._cache) >= self.maxsize:
+            now = expires - max(self.ttl, self.negative_ttl)
+            for k, (t, r) in list(self._cache.items()):
+                if t <= now:
+                    del self._cache[k]
+            if len(self._cache) >= self.maxsize:
+                self._cache.clear()
+        self._cache[key] = (expires, result)
+
+# used by create_connection() unless it is given another
+default_resolver = Resolver()
+
+
+# Linux's IP_BIND_ADDRESS_NO_PORT, missing from older socket modules
+IP_BIND_ADDRESS_NO_PORT = getattr(socket, 'IP_BIND_ADDRESS_NO_PORT',
+                                  24 if sys.platform.startswith('linux') else None)
+
+
+class SourceAddressPool(object):
+    """Local addresses to bind new connections to, taken in turn.
+
+    `addresses` are IP address strings or (ip, port) pairs; with port 0
+    (the default) the system picks the port.  Each connection is bound
+    to the next address of its family, spreading connections to one
+    server over the ephemeral ports of every address.  An address whose
+    bind fails with EADDRINUSE or EADDRNOTAVAIL is skipped for the next,
+    as is one whose ports to the server are used up when connecting.
+
+    Where the system has IP_BIND_ADDRESS_NO_PORT (Linux), the port is
+    only picked at connect(), so that it need be unique per server
+    rather than per source address.
+
+    Share one pool between connections, by passing it as their
+    source_address; stats() reports the connections and failed binds
+    per address.
+    """
+
+    skip_errors = (errno.EADDRINUSE, errno.EADDRNOTAVAIL)
+
+    def __init__(self, addresses):
+        self.addresses = []
+        for address in addresses:
+            if hasattr(address, 'encode'):
+                address = (address, 0)
+            self.addresses.append(tuple(address))
+        if not self.addresses:
+            raise ValueError("no source addresses")
+        self.connections = dict((address, 0) for address in self.addresses)
+        self.failures = dict((address, 0) for address in self.addresses)
+        self._next = 0
+
+    def bind(self, sock):
+        """Bind `sock` to the next usable address, and return it."""
+        count = len(self.addresses)
+        error = None
+        for i in range(count):
+            address = self.addresses[(self._next + i) % count]
+            family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+            if family != sock.family:
+                continue
+            if address[1] == 0 and IP_BIND_ADDRESS_NO_PORT is not None:
+                try:
+                    sock.setsockopt(socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+                except socket.error:
+                    pass   # an older kernel; the port is picked by bind()
+            try:
+                sock.bind(address)
+            except socket.error as e:
+                if e.errno not in self.skip_errors:
+                    raise
+                self.failures[address] += 1
+                error = e
+                continue
+            self._next = (self._next + i + 1) % count
+            self.connections[address] += 1
+            return address
+        if error is not None:
+            raise error
+        raise socket.error(errno.EAFNOSUPPORT, "no source address of the connection's family")
+
+    def stats(self):
+        """{address: {'connections': n, 'failures': n}} for each address."""
+        return dict((address, {'connections': self.connections[address],
+                               'failures': self.failures[address]})
+                    for address in self.addresses)
+
+
+def _set_tcp_keepalive(sock, keepalive):
+    """Turn on TCP keepalive probes for `sock`.
+
+    `keepalive` is True for the system's settings, or (idle, interval,
+    count): the seconds idle before the first probe, the seconds between
+    probes and the number of unanswered probes before the connection is
+    dropped; options the platform lacks are skipped.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if keepalive is True:
+        return
+    for name, value in zip(('TCP_KEEPIDLE', 'TCP_KEEPINTVL', 'TCP_KEEPCNT'), keepalive):
+        option = getattr(socket, name, None)
+        if option is not None and value is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+
+# Linux's TCP_FASTOPEN_CONNECT, missing from older socket modules
+TCP_FASTOPEN_CONNECT = getattr(socket, 'TCP_FASTOPEN_CONNECT',
+                               30 if sys.platform.startswith('linux') else None)
+
+
+def tcp_socket_options(nodelay=True, sndbuf=None, rcvbuf=None, quickack=False):
+    """Return a list of (level, option, value) socket options.
+
+    `nodelay` turns off Nagle's algorithm, `sndbuf` and `rcvbuf` set the
+    kernel buffer sizes in bytes, and `quickack` asks Linux to send ACKs
+    at once rather than delaying them; options the platform lacks are
+    left out.
+    """
+    options = []
+    if nodelay:
+        options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    if sndbuf:
+        options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf))
+    if rcvbuf:
+        options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf))
+    if quickack and hasattr(socket, 'TCP_QUICKACK'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1))
+    return options
+
+
+def _set_socket_options(sock, socket_options=None, fast_open=False):
+    # before connecting, so that buffer sizes count towards the window
+    # scale negotiated in the handshake
+    for level, option, value in socket_options or ():
+        sock.setsockopt(level, option, value)
+    if fast_open and TCP_FASTOPEN_CONNECT is not None:
+        # connect() then returns at once, and the first write goes in the
+        # SYN along with the server's cookie from an earlier connection;
+        # kernels without client TFO refuse the option, and are left be
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1)
+        except socket.error:
+            pass
+
+
 @asyncio.coroutine
-def create_connection(address, timeout=None, source_address=None, loop=None,
-                      ssl=None, server_hostname=None):
+def _connect_sock(loop, addrinfo, source_address=None, socket_options=None, fast_open=False):
+    family, type_, proto, canonname, sockaddr = addrinfo
+    pool = source_address if isinstance(source_address, SourceAddressPool) else None
+    # a pooled source address whose ports to the server are used up is
+    # skipped for the next one
+    attempts = len(pool.addresses) if pool is not None else 1
+    for attempt in range(attempts):
+        sock = socket.socket(family, type_, proto)
+        bound = None
+        try:
+            sock.setblocking(False)
+            _set_socket_options(sock, socket_options, fast_open)
+            if pool is not None:
+                bound = pool.bind(sock)
+            elif source_address:
+                sock.bind(source_address)
+            yield From (loop.sock_connect(sock, sockaddr))
+        except socket.error as e:
+            sock.close()
+            if (bound is not None and e.errno == errno.EADDRNOTAVAIL and
+                    attempt + 1 < attempts):
+                pool.failures[bound] += 1
+                continue
+            raise
+        except:
+            sock.close()
+            raise
+        raise Return (sock)
 
-    #def _tmp_protocol():
-    #     raise Return (asyncio.Protocol())
 
+@asyncio.coroutine
+def _staggered_connect(loop, infos, delay, timeout, source_address=None, **sock_kw):
+    """Race connection attempts to `infos`, starting the next one when
+    the previous fails or has been pending for `delay` seconds (RFC 8305).
+
+    Returns (sock, addrinfo) for the first attempt to connect; the other
+    attempts are cancelled, and their sockets closed.
+    """
+    infos = collections.deque(infos)
+    running = set()
+    errors = []
+    try:
+        while True:
+            if infos:
+                addrinfo = infos.popleft()
+                attempt = asyncio.ensure_future(
+                    asyncio.wait_for(_connect_sock(loop, addrinfo, source_address, **sock_kw),
+                                     timeout, loop=loop), loop=loop)
+                attempt.addrinfo = addrinfo
+                running.add(attempt)
+            elif not running:
+                break
+            done, running = yield From (asyncio.wait(running, loop=loop,
+                                                     timeout=delay if infos else None,
+                                                     return_when=asyncio.FIRST_COMPLETED))
+            winner = None
+            for attempt in done:
+                try:
+                    sock = attempt.result()
+                except (socket.error, OSError, asyncio.TimeoutError) as e:
+                    errors.append(e)
+                    continue
+                if winner is None:
+                    winner = (sock, attempt.addrinfo)
+                else:
+                    sock.close()
+            if winner is not None:
+                raise Return (winner)
+    finally:
+        for attempt in running:
+            if attempt.done() and not attempt.cancelled() and attempt.exception() is None:
+                attempt.result().close()
+            else:
+                attempt.cancel()
+    raise errors[-1]
+
+
+@asyncio.coroutine
+def _connect_tunnel(loop, sock, request):
+    """Send a CONNECT request on a connected socket and read the proxy's
+    reply, leaving the socket at the start of the tunnelled stream."""
+    yield From (loop.sock_sendall(sock, request))
+    reply = b''
+    while b'\r\n\r\n' not in reply:
+        data = yield From (loop.sock_recv(sock, _MAXLINE))
+        if not data:
+            raise BadStatusLine(reply.decode("latin-1"))
+        reply += data
+        if len(reply) > _MAXLINE:
+            raise LineTooLong("CONNECT response")
+    head, rest = reply.split(b'\r\n\r\n', 1)
+    if rest:
+        raise HTTPException("data received after the CONNECT response")
+    status_line = head.split(b'\r\n', 1)[0].decode("latin-1")
+    try:
+        version, code, message = (status_line.split(None, 2) + [''])[:3]
+        code = int(code)
+    except ValueError:
+        raise BadStatusLine(status_line)
+    if code != 200:
+        raise OSError("Tunnel connection failed: %d %s" % (code, message.strip()))
+
+
+@asyncio.coroutine
+def create_connection(address, timeout=None, source_address=None, loop=None,
+                      ssl=None, server_hostname=None, resolver=None,
+                      happy_eyeballs_delay=0.25, tunnel_request=None,
+                      tcp_keepalive=None, socket_options=None, fast_open=False):
+    """Connect to a (host, port) address, and return a NotSocket.
+
+    The host name is looked up through `resolver`, by default the
+    module's default_resolver.  Connection attempts to the addresses
+    are staggered by `happy_eyeballs_delay` seconds, alternating address
+    families, and the first to connect is used; with a delay of None the
+    addresses are tried one at a time.
+
+    `tunnel_request`, a CONNECT request, is sent to the proxy at
+    `address` before the TLS handshake, which is then made with the
+    tunnelled server.  `tcp_keepalive` is passed to _set_tcp_keepalive().
+    `source_address` may be a SourceAddressPool, to take turns binding
+    to several local addresses.
+
+    `socket_options`, a list of (level, option, value) such as
+    tcp_socket_options() returns, are set on the socket before it
+    connects.  With `fast_open`, TCP Fast Open is used where Linux
+    supports it: on repeat connections to a server the first data sent
+    rides in the SYN, saving a round trip.
+    """
     if loop is None:
         loop = asyncio.get_event_loop()
+    if resolver is None:
+        resolver = default_resolver
     host, port = address
-    #(transport, protocol) = yield From (loop.create_connection(asyncio.StreamReader, host, port, ssl=ssl,
-    #                                                          local_addr=source_address)
+    if ssl and server_hostname is None:
+        server_hostname = host
+
+    infos = yield From (resolver.resolve(host, port, loop=loop))
+    infos = resolver.sort_addresses(host, port, infos)
+    if not infos:
+        raise socket.gaierror('no addresses for %s' % host)
+    sock_kw = {'socket_options': socket_options, 'fast_open': fast_open}
+    if happy_eyeballs_delay is None or len(infos) == 1:
+        error = None
+        for addrinfo in infos:
+            try:
+                sock = yield From (asyncio.wait_for(_connect_sock(loop, addrinfo, source_address,
+                                                                  **sock_kw),
+                                                    timeout, loop=loop))
+                break
+            except (socket.error, OSError, asyncio.TimeoutError) as e:
+                error = e
+        else:
+            raise error
+    else:
+        sock, addrinfo = yield From (_staggered_connect(loop, infos, happy_eyeballs_delay,
+                                                        timeout, source_address, **sock_kw))
+    resolver.connected(host, port, addrinfo)
+    if tcp_keepalive:
+        _set_tcp_keepalive(sock, tcp_keepalive)
+
+    if tunnel_request is not None:
+        try:
+            yield From (asyncio.wait_for(_connect_tunnel(loop, sock, tunnel_request),
+                                         timeout, loop=loop))
+        except:
+            sock.close()
+            raise
+
+    reader, writer = yield From (asyncio.open_connection(sock=sock, ssl=ssl, limit=_MAXLINE,
+                                                     server_hostname=server_hostname,
+                                                     loop=loop))
+    raise Return (NotSocket(reader, writer))
 
-    reader, writer = yield From (asyncio.open_connection(host, port, ssl=ssl, limit=_MAXLINE,
-                                                     local_addr=source_address))
 
-    #sock = transport.get_extra_info('socket')
-    #raise Return (sock)
+@asyncio.coroutine
+def create_unix_connection(path, timeout=None, loop=None):
+    """Connect to the Unix domain socket at `path`, and return a NotSocket."""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    reader, writer = yield From (asyncio.wait_for(
+        asyncio.open_unix_connection(path, limit=_MAXLINE, loop=loop), timeout, loop=loop))
     raise Return (NotSocket(reader, writer))
 
 
-class HTTPConnection:
+class HTTPConnection(object):
 
     _http_vsn = 11
     _http_vsn_str = 'HTTP/1.1'
@@ -976,16 +1971,53 @@ class HTTPConnection:
     # instead a reasonable estimate is chosen.  The getsockopt()
     # interface using the TCP_MAXSEG parameter may be a suitable
     # approach on some operating systems. A value of 16KiB is chosen
-    # as a reasonable estimate of the maximum MSS.
+    # as a reasonable estimate of the maximum MSS.  Request bodies are
+    # now sent with the headers in a gathered write whatever their size,
+    # so this is no longer used here.
     mss = 16384
+    # seconds between staggered connection attempts when the host has
+    # several addresses; None leaves create_connection's default
+    happy_eyeballs_delay = None
+    # True or (idle, interval, count) to enable TCP keepalive probes
+    tcp_keepalive = None
+    # bytes read at a time from file-like bodies which are not regular
+    # files, and the concurrent.futures executor the reads run in (None
+    # for the loop's default)
+    blocksize = 1 << 18
+    executor = None
+    # bytes coalesced into each chunk of a chunked request body
+    chunk_size = 16384
+    # high and low water marks of the write buffer for streamed bodies;
+    # None for the transport's defaults
+    write_buffer_high = None
+    write_buffer_low = None
+    # send regular files with os.sendfile() where the socket allows it
+    # (not over TLS, nor where the os module has no sendfile()); turn it
+    # off for files on slow or network storage to have them read in the
+    # executor instead
+    use_sendfile = True
+    # the zlib level of bodies sent with a content_encoding, and the size
+    # of body pieces from which they are compressed in the executor
+    # (None to compress on the loop)
+    compress_level = -1
+    compress_offload = None
+    # seconds to wait for 100 (Continue) to a request with
+    # expect_continue, before sending its body anyway
+    continue_timeout = 1.0
+    # (level, option, value) set on new sockets; see tcp_socket_options()
+    socket_options = tcp_socket_options()
+    # TCP Fast Open, on Linux
+    fast_open = False
 
     loop = asyncio.get_event_loop()
 
-    def __init__(self, host, port=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    def __init__(self, host, port=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None,
+                 resolver=None):
         if type(timeout) == type(object()):
             timeout = 30.0
         self.TIMEOUT = timeout
         self.source_address = source_address
+        self.resolver = resolver
         self.notSock = None
         self._buffer = []
         self.__response = None
@@ -994,6 +2026,15 @@ class HTTPConnection:
         self._tunnel_host = None
         self._tunnel_port = None
         self._tunnel_headers = {}
+        self._pipelining = False
+        # pipelined requests awaiting their responses, as
+        # [method, list of request parts or None, aborted, replayed] lists
+        self._pipeline = collections.deque()
+        # pipelined request parts not yet written
+        self._pipeline_out = []
+        # set when a request body was withheld after an early response,
+        # leaving the connection unfit for reuse
+        self._close_after_response = False
 
         (self.host, self.port) = self._get_hostport(host, port)
 
@@ -1026,6 +2067,18 @@ class HTTPConnection:
         else:
             self._tunnel_headers.clear()
 
+    def _tunnel_request(self):
+        # the CONNECT request and its headers, to be sent in one write
+        (host, port) = self._get_hostport(self._tunnel_host,
+                                          self._tunnel_port)
+        connect_str = "CONNECT %s:%d HTTP/1.0\r\n" % (host, port)
+        lines = [connect_str.encode("ascii")]
+        for header, value in self._tunnel_headers.items():
+            header_str = "%s: %s\r\n" % (header, value)
+            lines.append(header_str.encode("latin-1"))
+        lines.append(b'\r\n')
+        return b''.join(lines)
+
     def _get_hostport(self, host, port):
         if port is None:
             i = host.rfind(':')
@@ -1049,24 +2102,49 @@ class HTTPConnection:
     def set_debuglevel(self, level):
         self.debuglevel = level
 
+    def _connect_kw(self):
+        # optional arguments for self._create_connection
+        kw = {}
+        if self.resolver is not None:
+            kw['resolver'] = self.resolver
+        if self.happy_eyeballs_delay is not None:
+            kw['happy_eyeballs_delay'] = self.happy_eyeballs_delay
+        if self.tcp_keepalive:
+            kw['tcp_keepalive'] = self.tcp_keepalive
+        if self.socket_options:
+            kw['socket_options'] = self.socket_options
+        if self.fast_open:
+            kw['fast_open'] = True
+        return kw
+
+    def set_pipelining(self, enabled=True):
+        """Allow requests to be made before the earlier responses are read.
+
+        Pipelined requests are queued, and written together in one write
+        when flush() or getresponse() is called.  getresponse() then
+        returns the responses in the order the requests were made, each
+        of which must be read to the end before the next is retrieved.
+
+        If the server closes the connection part way through the
+        pipeline, the unanswered requests with idempotent methods are
+        sent again, once, on a new connection; getresponse() raises
+        PipelineAborted for the others.  Requests with a streamed (file
+        or iterable) body are written immediately, and are not resent.
+        """
+        if self._pipeline:
+            raise CannotSendRequest("pipelined requests are pending")
+        self._pipelining = enabled
+
     @asyncio.coroutine
     def _tunnel(self):
-        (host, port) = self._get_hostport(self._tunnel_host,
-                                          self._tunnel_port)
-        connect_str = "CONNECT %s:%d HTTP/1.0\r\n" % (host, port)
-        connect_bytes = connect_str.encode("ascii")
-        yield From (self.send(connect_bytes))
-        for header, value in self._tunnel_headers.items():
-            header_str = "%s: %s\r\n" % (header, value)
-            header_bytes = header_str.encode("latin-1")
-            yield From (self.send(header_bytes))
-        yield From (self.send(b'\r\n'))
+        yield From (self.send(self._tunnel_request()))
 
         response = self.response_class(self.notSock, method=self._method)
         #yield From (response.init())
         (version, code, message) = yield From (response._read_status())
 
         if code != 200:
+            response._close_conn()
             self.close()
             raise OSError("Tunnel connection failed: %d %s" % (code, message.strip()))
         while True:
@@ -1082,13 +2160,15 @@ class HTTPConnection:
                 break
             if line in (b'\r\n', b'\n', b''):
                 break
+        # hand the socket back; the tunnel lives as long as the connection
+        response._close_conn()
 
     @asyncio.coroutine
     def connect(self):
         """Connect to the host and port specified in __init__."""
 
-        #t, p = yield From (self._create_connection((self.host, self.port), self.TIMEOUT, self.source_address))
-        s = yield From (self._create_connection((self.host, self.port), self.TIMEOUT, self.source_address))
+        s = yield From (self._create_connection((self.host, self.port), self.TIMEOUT, self.source_address,
+                                                **self._connect_kw()))
 
         self.notSock = s
 
@@ -1105,23 +2185,52 @@ class HTTPConnection:
             self.__response.close()
             self.__response = None
         self.__state = _CS_IDLE
+        self._close_after_response = False
+        self._pipeline.clear()
+        del self._pipeline_out[:]
+
+    def detach(self):
+        """Take the socket away from the connection, and close the connection.
+
+        Returns the NotSocket if it can carry another request: the
+        connection is idle, its last response has been read to the end
+        and the server has not closed its side.  Otherwise the socket is
+        closed and None is returned.  Connection pools use this to keep
+        sockets after the HTTPConnection is done with them.
+        """
+        notSock = None
+        if (self.__state == _CS_IDLE and self.notSock is not None and
+                not self._pipeline and (self.__response is None or self.__response.isclosed()) and
+                not self.notSock.is_stale()):
+            notSock = self.notSock
+            self.notSock = None
+        self.close()
+        return notSock
 
     @asyncio.coroutine
     def send(self, data):
         """Send `data' to the server.
         ``data`` can be a string object, a bytes object, an array object, a
         file-like object that supports a .read() method, or an iterable object.
+        A list of bytes-like objects is written in one gathered write.
+        ``data`` may also be a producer, a function returning a coroutine
+        for each next piece and an empty piece at the end, or an object
+        with an __anext__() coroutine method (an async iterator).  Pieces
+        are written as they come, waiting only while the transport's write
+        buffer is above write_buffer_high.  An object with a body_parts()
+        method, such as a multipart.MultipartBody, has each of its parts
+        sent in turn.
         """
 
-        if self.notSock is None:
-            if self.auto_open:
-                yield From (self.connect())
-            else:
-                raise NotConnected()
+        yield From (self._prepare_send())
 
         if self.debuglevel > 0:
             print("send:", repr(data))
-        blocksize = 8192
+        if hasattr(data, "body_parts"):
+            for part in data.body_parts():
+                yield From (self.send(part))
+            return
+        blocksize = self.blocksize
         if hasattr(data, "read") :
             if self.debuglevel > 0:
                 print("sendIng a read()able")
@@ -1137,14 +2246,38 @@ class HTTPConnection:
                     encode = True
                     if self.debuglevel > 0:
                         print("encoding file using iso-8859-1")
+            if (self.use_sendfile and not encode and _is_regular_file(data) and
+                    self.notSock.can_sendfile()):
+                if self.debuglevel > 0:
+                    print("sendIng with sendfile()")
+                yield From (self.notSock.sendfile(data))
+                return
+            # reads go to the executor, so a slow disk does not stall the
+            # loop; the next block is read while the last one is written
+            loop = self.notSock._loop
+            reading = loop.run_in_executor(self.executor, data.read, blocksize)
             while 1:
-                datablock = data.read(blocksize)
+                datablock = yield From (reading)
                 if not datablock:
                     break
+                reading = loop.run_in_executor(self.executor, data.read, blocksize)
                 if encode:
                     datablock = datablock.encode("iso-8859-1")
                 # yield From (self.loop.sock_sendall(self.soCk, datablock))
-                yield From (self.notSock.writeAndDrain(datablock))
+                yield From (self.notSock.writeBuffered(datablock))
+            return
+        if _is_producer(data):
+            while 1:
+                piece = yield From (_next_piece(data))
+                if piece is None:
+                    break
+                if not isinstance(piece, _BYTES_LIKE):
+                    piece = piece.encode("iso-8859-1")
+                yield From (self.notSock.writeBuffered(piece))
+            return
+        if isinstance(data, list):
+            # scatter-gather: a list of bytes-like parts goes in one write
+            yield From (self.notSock.writelinesAndDrain(data))
             return
         try:
             # yield From (self.loop.sock_sendall(self.soCk, data))
@@ -1154,7 +2287,7 @@ class HTTPConnection:
                  for d in data:
                      #yield From (self.loop.sock_sendall(self.soCk, d))
                      #d = chr(d).encode('ascii')
-                     yield From (self.notSock.writeAndDrain(d))
+                     yield From (self.notSock.writeBuffered(d))
             else:
                  raise TypeError("data should be a bytes-like object, got %r" % type(data))
 
@@ -1167,31 +2300,180 @@ class HTTPConnection:
         self._buffer.append(s)
 
     @asyncio.coroutine
-    def _send_output(self, message_body=None):
+    def _send_output(self, message_body=None, encode_chunked=False,
+                     expect_continue=False):
         """Send the currently buffered request and clear the buffer.
 
         Appends an extra \\r\\n to the buffer.
         A message_body may be specified, to be appended to the request.
+        With expect_continue, the body waits for the server's 100
+        (Continue), and is not sent at all if a final response comes
+        first.
         """
         self._buffer.extend((b"", b""))
         msg = b"\r\n".join(self._buffer)
         del self._buffer[:]
-        # If msg and message_body are sent in a single send() call,
-        # it will avoid performance problems caused by the interaction
-        # between delayed ack and the Nagle algorithm. However,
-        # there is no performance gain if the message is larger
-        # than MSS (and there is a memory penalty for the message
-        # copy).
-        if isinstance(message_body, bytes) and len(message_body) < self.mss:
-            msg += message_body
-            message_body = None
-        yield From (self.send(msg))
+        if self._pipelining:
+            yield From (self._queue_pipelined(msg, message_body, encode_chunked))
+            return
+        if expect_continue and message_body is not None:
+            yield From (self.send(msg))
+            msg = None
+            proceed = yield From (self._wait_for_continue())
+            if not proceed:
+                if encode_chunked:
+                    # an empty body ends the request in step with the
+                    # response, so the connection can be reused
+                    yield From (self.send(b"0\r\n\r\n"))
+                else:
+                    # the server is still owed Content-Length bytes
+                    self._close_after_response = True
+                return
+        if encode_chunked and message_body is not None:
+            yield From (self._send_chunked(message_body, msg))
+            return
+        # Sending msg and message_body in a single write avoids the
+        # interaction between delayed ack and the Nagle algorithm; a
+        # gathered write does so without copying the body onto msg,
+        # whatever its size.
+        if isinstance(message_body, _BYTES_LIKE):
+            yield From (self.send([msg, message_body] if msg else message_body))
+            return
+        if msg:
+            yield From (self.send(msg))
         if message_body is not None:
             # message_body was not a string (i.e. it is a file), and
             # we must run the risk of Nagle.
             yield From (self.send(message_body))
 
+    @asyncio.coroutine
+    def _wait_for_continue(self):
+        # Wait for the answer to a request's head sent with Expect:
+        # 100-continue.  Interim responses are consumed; a final response
+        # is left to getresponse().  True if the body should be sent.
+        while True:
+            line = yield From (self.notSock.peekline(self.continue_timeout))
+            if line is None:
+                # no answer in time: the server may not know the
+                # expectation, so send the body anyway
+                raise Return (True)
+            try:
+                status = int(line.split(None, 2)[1])
+            except (IndexError, ValueError):
+                # getresponse() will make sense of it, or fail
+                raise Return (False)
+            if not 100 <= status < 200:
+                raise Return (False)
+            if self.debuglevel > 0:
+                print("interim:", repr(line))
+            yield From (self.notSock.readline())
+            while True:
+                line = yield From (self.notSock.readline())
+                if len(line) > _MAXLINE:
+                    raise LineTooLong("header line")
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            if not line:
+                # closed early; getresponse() will find no status line
+                raise Return (False)
+            if status == CONTINUE:
+                raise Return (True)
+
+    @asyncio.coroutine
+    def _prepare_send(self):
+        # connect if need be, and set the socket's write buffer limits
+        if self.notSock is None:
+            if self.auto_open:
+                yield From (self.connect())
+            else:
+                raise NotConnected()
+        limits = (self.write_buffer_high, self.write_buffer_low)
+        if limits != (self.notSock.write_high, self.notSock.write_low):
+            self.notSock.set_write_limits(*limits)
+
+    @asyncio.coroutine
+    def _send_chunked(self, message_body, head=None):
+        """Send message_body with chunked transfer-coding, after head.
+
+        The body may be a file-like object, an iterable of bytes (or
+        str) pieces, a producer or async iterator, or an object with a
+        body_parts() method, as for send().
+        """
+        yield From (self._prepare_send())
 
+        writer = _ChunkedWriter(self.notSock, self.chunk_size, head)
+        yield From (self._write_pieces(writer, message_body))
+        yield From (writer.close())
+
+    @asyncio.coroutine
+    def _write_pieces(self, writer, body):
+        # feed the pieces of body to a _ChunkedWriter
+        if hasattr(body, "body_parts"):
+            for part in body.body_parts():
+                yield From (self._write_pieces(writer, part))
+        elif hasattr(body, "read"):
+            loop = self.notSock._loop
+            reading = loop.run_in_executor(self.executor, body.read, self.blocksize)
+            while 1:
+                piece = yield From (reading)
+                if not piece:
+                    break
+                reading = loop.run_in_executor(self.executor, body.read, self.blocksize)
+                yield From (writer.write(piece))
+        elif _is_producer(body):
+            while 1:
+                piece = yield From (_next_piece(body))
+                if piece is None:
+                    break
+                yield From (writer.write(piece))
+        else:
+            for piece in body:
+                yield From (writer.write(piece))
+
+    @asyncio.coroutine
+    def _queue_pipelined(self, msg, message_body, encode_chunked=False):
+        if message_body is not None and encode_chunked:
+            # a streamed body can neither be coalesced nor replayed
+            self._pipeline.append([self._method, None, False, False])
+            yield From (self.flush())
+            yield From (self._send_chunked(message_body, msg))
+        elif message_body is None or isinstance(message_body, _BYTES_LIKE):
+            parts = [msg]
+            if message_body:
+                parts.append(message_body)
+            self._pipeline_out.extend(parts)
+            self._pipeline.append([self._method, parts, False, False])
+        else:
+            # a streamed body can neither be coalesced nor replayed
+            self._pipeline.append([self._method, None, False, False])
+            yield From (self.flush())
+            yield From (self.send(msg))
+            yield From (self.send(message_body))
+
+    @asyncio.coroutine
+    def flush(self):
+        """Write the queued pipelined requests, in a single write."""
+        if self._pipeline_out:
+            parts = list(self._pipeline_out)
+            del self._pipeline_out[:]
+            yield From (self.send(parts))
+
+    def _replay_pipeline(self):
+        # The connection has gone; queue the unanswered requests again
+        # for a new one, except those it is not safe to resend.
+        if self.notSock is not None:
+            self.notSock.close()
+            self.notSock = None
+        del self._pipeline_out[:]
+        for entry in self._pipeline:
+            method, data, aborted, replayed = entry
+            if aborted:
+                continue
+            if data is None or replayed or method not in _IDEMPOTENT_METHODS:
+                entry[2] = True
+            else:
+                entry[3] = True
+                self._pipeline_out.extend(data)
 
     def putrequest(self, method, url, skip_host=0, skip_accept_encoding=0):
         """Send a request to the server.
@@ -1203,36 +2485,7 @@ class HTTPConnection:
            'Accept-Encoding:' header
         """
 
-        # if a prior response has been completed, then forget about it.
-        if self.__response and self.__response.isclosed():
-            self.__response = None
-
-
-        # in certain cases, we cannot issue another request on this connection.
-        # this occurs when:
-        #   1) we are in the process of sending a request.   (_CS_REQ_STARTED)
-        #   2) a response to a previous request has signalled that it is going
-        #      to close the connection upon completion.
-        #   3) the headers for the previous response have not been read, thus
-        #      we cannot determine whether point (2) is true.   (_CS_REQ_SENT)
-        #
-        # if there is no prior response, then we can request at will.
-        #
-        # if point (2) is true, then we will have passed the socket to the
-        # response (effectively meaning, "there is no prior response"), and
-        # will open a new one when a new request is made.
-        #
-        # Note: if a prior response exists, then we *can* start a new request.
-        #       We are not allowed to begin fetching the response to this new
-        #       request, however, until that prior response is complete.
-        #
-        if self.__state == _CS_IDLE:
-            self.__state = _CS_REQ_STARTED
-        else:
-            raise CannotSendRequest(self.__state)
-
-        # Save the method we use, we need it later in the response phase
-        self._method = method
+        self._begin_request(method)
         if not url:
             url = '/'
         request = '%s %s %s' % (method, url, self._http_vsn_str)
@@ -1252,46 +2505,7 @@ class HTTPConnection:
                 # issuing this header themselves. we should NOT issue
                 # it twice; some web servers (such as Apache) barf
                 # when they see two Host: headers
-
-                # If we need a non-standard port,include it in the
-                # header.  If the request is going through a proxy,
-                # but the host of the actual URL, not the host of the
-                # proxy.
-
-                netloc = ''
-                if url.startswith('http'):
-                    nil, netloc, nil, nil, nil = urlsplit(url)
-
-                if netloc:
-                    try:
-                        netloc_enc = netloc.encode("ascii")
-                    except UnicodeEncodeError:
-                        netloc_enc = netloc.encode("idna")
-                    self.putheader('Host', netloc_enc)
-                else:
-                    if self._tunnel_host:
-                        host = self._tunnel_host
-                        port = self._tunnel_port
-                    else:
-                        host = self.host
-                        port = self.port
-
-                    try:
-                        host_enc = host.encode("ascii")
-                    except UnicodeEncodeError:
-                        host_enc = host.encode("idna")
-
-                    # As per RFC 273, IPv6 address should be wrapped with []
-                    # when used as Host header
-
-                    if host.find(':') >= 0:
-                        host_enc = b'[' + host_enc + b']'
-
-                    if port == self.default_port:
-                        self.putheader('Host', host_enc)
-                    else:
-                        host_enc = host_enc.decode("ascii")
-                        self.putheader('Host', "%s:%s" % (host_enc, port))
+                self.putheader('Host', self._host_header(url))
 
             # note: we are assuming that clients will not attempt to set these
             #       headers since *this* library must deal with the
@@ -1316,6 +2530,84 @@ class HTTPConnection:
             # For HTTP/1.0, the server will assume "not chunked"
             pass
 
+    def _begin_request(self, method):
+        # if a prior response has been completed, then forget about it.
+        if self.__response and self.__response.isclosed():
+            self.__response = None
+
+        # a kept-alive connection may have been closed by the server while
+        # idle; drop it here so that send() opens a fresh one.
+        if (self.notSock is not None and self.__response is None and
+                not self._pipeline):
+            if self.notSock.is_stale():
+                self.notSock.close()
+                self.notSock = None
+
+        # in certain cases, we cannot issue another request on this connection.
+        # this occurs when:
+        #   1) we are in the process of sending a request.   (_CS_REQ_STARTED)
+        #   2) a response to a previous request has signalled that it is going
+        #      to close the connection upon completion.
+        #   3) the headers for the previous response have not been read, thus
+        #      we cannot determine whether point (2) is true.   (_CS_REQ_SENT)
+        #
+        # if there is no prior response, then we can request at will.
+        #
+        # if point (2) is true, then we will have passed the socket to the
+        # response (effectively meaning, "there is no prior response"), and
+        # will open a new one when a new request is made.
+        #
+        # Note: if a prior response exists, then we *can* start a new request.
+        #       We are not allowed to begin fetching the response to this new
+        #       request, however, until that prior response is complete.
+        #
+        if self.__state == _CS_IDLE:
+            self.__state = _CS_REQ_STARTED
+        else:
+            raise CannotSendRequest(self.__state)
+
+        # Save the method we use, we need it later in the response phase
+        self._method = method
+
+    def _host_header(self, url):
+        # If we need a non-standard port,include it in the
+        # header.  If the request is going through a proxy,
+        # but the host of the actual URL, not the host of the
+        # proxy.
+
+        netloc = ''
+        if url.startswith('http'):
+            nil, netloc, nil, nil, nil = urlsplit(url)
+
+        if netloc:
+            try:
+                return netloc.encode("ascii")
+            except UnicodeEncodeError:
+                return netloc.encode("idna")
+
+        if self._tunnel_host:
+            host = self._tunnel_host
+            port = self._tunnel_port
+        else:
+            host = self.host
+            port = self.port
+
+        try:
+            host_enc = host.encode("ascii")
+        except UnicodeEncodeError:
+            host_enc = host.encode("idna")
+
+        # As per RFC 273, IPv6 address should be wrapped with []
+        # when used as Host header
+
+        if host.find(':') >= 0:
+            host_enc = b'[' + host_enc + b']'
+
+        if port == self.default_port:
+            return host_enc
+        host_enc = host_enc.decode("ascii")
+        return "%s:%s" % (host_enc, port)
+
     def putheader(self, header, *values):
         """Send a request header line to the server.
 
@@ -1324,59 +2616,118 @@ class HTTPConnection:
         if self.__state != _CS_REQ_STARTED:
             raise CannotSendHeader()
 
-        if hasattr(header, 'encode'):
-            header = header.encode('ascii')
-        values = list(values)
-        for i, one_value in enumerate(values):
-            if hasattr(one_value, 'encode'):
-                values[i] = one_value.encode('latin-1')
-            elif isinstance(one_value, int):
-                values[i] = str(one_value).encode('ascii')
-        value = b'\r\n\t'.join(values)
-        header = header + b': ' + value
-        self._output(header)
+        self._output(_header_line(header, values))
+
+    def template(self, method, url, headers={}, variable_headers=()):
+        """Return a RequestTemplate for repeated requests like
+        request(method, url, headers=headers), with its head serialized
+        once; its Host header is this connection's.
+
+        The headers named in variable_headers are left out, to be given
+        to each send_template() call.
+        """
+        if not url:
+            url = '/'
+        header_names = dict.fromkeys([k.lower() for k in headers])
+        lines = []
+        if self._http_vsn == 11:
+            if 'host' not in header_names:
+                lines.append(_header_line('Host', (self._host_header(url),)))
+            if 'accept-encoding' not in header_names:
+                lines.append(_header_line('Accept-Encoding', ('identity',)))
+        for hdr, value in headers.items():
+            lines.append(_header_line(hdr, (value,)))
+        return RequestTemplate(method, url, lines, variable_headers, self._http_vsn_str)
+
+    @asyncio.coroutine
+    def send_template(self, template, path=None, query=None, headers=None, body=None):
+        """Send a request from a RequestTemplate; read its response with
+        getresponse() as usual.
+
+        `path` replaces the template's path, and `query` is added to it
+        after a '?'.  `headers` gives values for the template's variable
+        headers.  `body`, bytes-like or str, is sent with a
+        Content-Length.
+        """
+        self._begin_request(template.method)
+        if body is not None and not isinstance(body, _BYTES_LIKE):
+            body = body.encode('iso-8859-1')
+        parts = template.render(path, query, headers, body)
+        self.__state = _CS_REQ_SENT
+        if self._pipelining:
+            self._pipeline_out.extend(parts)
+            self._pipeline.append([self._method, parts, False, False])
+            # the request is queued; the next one may be started
+            self.__state = _CS_IDLE
+        else:
+            yield From (self.send(parts))
 
     @asyncio.coroutine
-    def endheaders(self, message_body=None):
+    def endheaders(self, message_body=None, encode_chunked=False,
+                   expect_continue=False):
         """Indicate that the last header line has been sent to the server.
 
         This method sends the request to the server.  The optional message_body
         argument can be used to pass a message body associated with the
         request.  The message body will be sent in the same packet as the
         message headers if it is a string, otherwise it is sent as a separate
-        packet.
+        packet.  With encode_chunked, the body is sent with chunked
+        transfer-coding, for which a Transfer-Encoding header must have been
+        put.  With expect_continue, for which an Expect: 100-continue header
+        must have been put, the body is sent once the server answers 100
+        (Continue), or continue_timeout seconds pass without an answer; an
+        early final response means it is not sent.
         """
         if self.__state == _CS_REQ_STARTED:
             self.__state = _CS_REQ_SENT
         else:
             raise CannotSendHeader()
-        yield From (self._send_output(message_body))
+        yield From (self._send_output(message_body, encode_chunked, expect_continue))
+        if self._pipelining:
+            # the request is queued; the next one may be started
+            self.__state = _CS_IDLE
 
 
     @asyncio.coroutine
-    def request(self, method, url, body=None, headers={}):
-        """Send a complete request to the server."""
-        yield From (self._send_request(method, url, body, headers))
+    def request(self, method, url, body=None, headers={}, encode_chunked=False,
+                expect_continue=False, content_encoding=None):
+        """Send a complete request to the server.
+
+        A body whose length cannot be found (an iterable, a producer
+        coroutine function, or a file-like object that is not a regular
+        file) is sent with chunked transfer-coding, unless headers has a
+        Content-Length or Transfer-Encoding.  Pass encode_chunked if the
+        Transfer-Encoding given in headers is chunked.
+
+        With expect_continue, a body is sent with Expect: 100-continue and
+        held back until the server agrees to take it (see endheaders()).
+        If the server answers early, say 401 or 413, getresponse() returns
+        that response; the connection stays open for the next request if
+        the body was chunked, and is closed otherwise.
+
+        With content_encoding 'gzip' or 'deflate' the body is compressed
+        as it is sent, with a Content-Encoding header.  A bytes body is
+        compressed before the head is sent, to give its Content-Length;
+        others are streamed through zlib, with chunked transfer-coding.
+        """
+        yield From (self._send_request(method, url, body, headers, encode_chunked,
+                                       expect_continue, content_encoding))
 
     def _set_content_length(self, body):
-        # Set the content-length based on the body.
-        thelen = None
-        try:
-            thelen = str(len(body))
-        except TypeError as te:
-            # If this is a file-like object, try to
-            # fstat its file descriptor
-            try:
-                thelen = str(os.fstat(body.fileno()).st_size)
-            except (AttributeError, OSError):
-                # Don't send a length if this failed
-                if self.debuglevel > 0: print("Cannot stat!!")
-
-        if thelen is not None:
-            self.putheader('Content-Length', thelen)
+        # Set the content-length based on the body, and return it; None if
+        # it cannot be found.
+        thelen = _body_length(body)
+        if thelen is None:
+            # Don't send a length if this failed
+            if self.debuglevel > 0: print("Cannot stat!!")
+            return None
+        thelen = str(thelen)
+        self.putheader('Content-Length', thelen)
+        return thelen
 
     @asyncio.coroutine
-    def _send_request(self, method, url, body, headers):
+    def _send_request(self, method, url, body, headers, encode_chunked=False,
+                      expect_continue=False, content_encoding=None):
         # Honor explicitly requested Host: and Accept-Encoding: headers.
         header_names = dict.fromkeys([k.lower() for k in headers])
         skips = {}
@@ -1385,17 +2736,48 @@ class HTTPConnection:
         if 'accept-encoding' in header_names:
             skips['skip_accept_encoding'] = 1
 
+        if not isinstance(body, _BYTES_LIKE) and hasattr(body, 'encode'):
+            # RFC 2616 Section 3.7.1 says that text default has a
+            # default charset of iso-8859-1.
+            body = body.encode('iso-8859-1')
+        # a multipart body knows its Content-Type, with its boundary
+        content_type = getattr(body, 'content_type', None)
+        if body is not None and content_encoding is not None:
+            # the loop the connection runs on; until it is connected, the
+            # one it will connect on
+            if self.notSock is not None:
+                loop = self.notSock._loop
+            else:
+                loop = asyncio.get_event_loop()
+            compressed = _CompressedBody(
+                body, _compressor(content_encoding, self.compress_level), loop,
+                self.executor, self.blocksize, self.compress_offload)
+            if isinstance(body, _BYTES_LIKE):
+                # compressed up front, to be sent with its length
+                body = yield From (compressed.read_all())
+            else:
+                body = compressed
+
         self.putrequest(method, url, **skips)
 
         if body is not None and ('content-length' not in header_names):
-            self._set_content_length(body)
+            if (self._set_content_length(body) is None and
+                    'transfer-encoding' not in header_names):
+                # the body is framed by chunks instead
+                self.putheader('Transfer-Encoding', 'chunked')
+                encode_chunked = True
+        if body is None:
+            expect_continue = False
+        elif expect_continue and 'expect' not in header_names:
+            self.putheader('Expect', '100-continue')
+        if (body is not None and content_encoding is not None and
+                'content-encoding' not in header_names):
+            self.putheader('Content-Encoding', content_encoding)
+        if content_type is not None and 'content-type' not in header_names:
+            self.putheader('Content-Type', content_type)
         for hdr, value in headers.items():
             self.putheader(hdr, value)
-        if isinstance(body, str):
-            # RFC 2616 Section 3.7.1 says that text default has a
-            # default charset of iso-8859-1.
-            body = body.encode('iso-8859-1')
-        yield From (self.endheaders(body))
+        yield From (self.endheaders(body, encode_chunked, expect_continue))
 
     @asyncio.coroutine
     def getresponse(self):
@@ -1410,7 +2792,12 @@ class HTTPConnection:
         response indicates that the connection should be closed, then
         it will be closed before the response is returned.  When the
         connection is closed, the underlying socket is closed.
+
+        Otherwise the connection keeps its socket, and the next request
+        reuses it once this response has been read to the end.
         """
+        if self._pipelining:
+            raise Return ((yield From (self._getresponse_pipelined())))
 
         # if a prior response has been completed, then forget about it.
         if self.__response and self.__response.isclosed():
@@ -1441,29 +2828,214 @@ class HTTPConnection:
             response = self.response_class(self.notSock, method=self._method)
         #yield From (response.init())
 
-        yield From (response.begin())
+        try:
+            yield From (response.begin())
+        except:
+            # the stream is out of step with the request/response cycle,
+            # so the connection cannot be reused
+            response.close()
+            self.close()
+            raise
         assert response.will_close != _UNKNOWN
         self.__state = _CS_IDLE
+        if self._close_after_response:
+            self._close_after_response = False
+            response.will_close = True
 
         if response.will_close:
-        #     # this effectively passes the connection to the response
-        #     #self.close()
+            # this effectively passes the connection to the response
             self.__response = None
+            self.notSock.close()
+            self.notSock = None
         else:
-            # remember this, so we can tell when it is complete
+            # remember this, so we can tell when it is complete; the
+            # connection keeps its reference to the socket for reuse
             self.__response = response
+            self.notSock.keep_alive(response.getheader('keep-alive'))
 
-        self.notSock.close()
-        self.notSock = None
+        raise Return (response)
+
+    @asyncio.coroutine
+    def _getresponse_pipelined(self):
+        if self.__response and self.__response.isclosed():
+            self.__response = None
+        if self.__state != _CS_IDLE or self.__response or not self._pipeline:
+            raise ResponseNotReady(self.__state)
 
+        while True:
+            method, data, aborted, replayed = self._pipeline[0]
+            if aborted:
+                self._pipeline.popleft()
+                raise PipelineAborted(method)
+            yield From (self.flush())
+            response = self.response_class(self.notSock, self.debuglevel,
+                                           method=method)
+            try:
+                yield From (response.begin())
+            except BadStatusLine:
+                reader = self.notSock.reader
+                at_eof = reader is None or reader.at_eof()
+                response.close()
+                if not at_eof:
+                    self.close()
+                    raise
+                # closed before answering this request
+                self._replay_pipeline()
+                continue
+            except:
+                response.close()
+                self.close()
+                raise
+            break
+
+        self._pipeline.popleft()
+        if response.will_close:
+            self.__response = None
+            self._replay_pipeline()
+        else:
+            self.__response = response
+            self.notSock.keep_alive(response.getheader('keep-alive'))
         raise Return (response)
 
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP over the Unix domain socket at `path`.
+
+    `host` is sent in the Host header, with no port.
+    """
+
+    def __init__(self, path, host='localhost', timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        super(UnixHTTPConnection, self).__init__(host, self.default_port, timeout)
+        self.path = path
+        self._create_unix_connection = create_unix_connection
+
+    @asyncio.coroutine
+    def connect(self):
+        """Connect to the socket path specified in __init__."""
+
+        self.notSock = yield From (self._create_unix_connection(self.path, self.TIMEOUT))
+
 try:
     import ssl
 except ImportError:
     pass
 else:
-    class HTTPSConnection(object, HTTPConnection):
+    class TLSSessionCache(object):
+        """TLS sessions kept for resumption, per (host, port, context).
+
+        Holds up to `maxsize` sessions, dropping the least recently used.
+        Sessions are only available where the ssl module has SSLSession
+        (Python 3.6 and later); elsewhere the cache stays empty.
+        """
+
+        def __init__(self, maxsize=256):
+            self.maxsize = maxsize
+            self._sessions = collections.OrderedDict()
+
+        def get(self, key):
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self._sessions[key] = session
+            return session
+
+        def put(self, key, session):
+            self._sessions.pop(key, None)
+            if self.maxsize <= 0:
+                return
+            while len(self._sessions) >= self.maxsize:
+                self._sessions.popitem(last=False)
+            self._sessions[key] = session
+
+        def discard(self, key):
+            self._sessions.pop(key, None)
+
+        def clear(self):
+            self._sessions.clear()
+
+        def __len__(self):
+            return len(self._sessions)
+
+    # shared by HTTPSConnections not given a session_cache
+    default_session_cache = TLSSessionCache()
+
+    def _file_stamps(*paths):
+        stamps = []
+        for path in paths:
+            try:
+                st = os.stat(path) if path else None
+            except OSError:
+                st = None
+            stamps.append(st and (st.st_mtime, st.st_size, st.st_ino))
+        return tuple(stamps)
+
+    class SSLContextCache(object):
+        """SSLContexts shared between connections.
+
+        get() returns one context per combination of verification
+        settings, CA file, certificate and key files and ALPN protocols,
+        so the CA bundle and PEM files are read once rather than for every
+        connection.  A context is rebuilt when one of its files changes on
+        disk.  Shared contexts should not be modified.
+        """
+
+        def __init__(self):
+            # settings -> (file stamps, context)
+            self._contexts = {}
+            # context -> the certificate chain loaded into it
+            self._chains = weakref.WeakKeyDictionary()
+
+        def get(self, cert_reqs=None, check_hostname=False, cafile=None,
+                cert_file=None, key_file=None, alpn_protocols=None):
+            if alpn_protocols is not None:
+                alpn_protocols = tuple(alpn_protocols)
+            key = (cert_reqs, check_hostname, cafile, cert_file, key_file, alpn_protocols)
+            stamps = _file_stamps(cafile, cert_file, key_file)
+            entry = self._contexts.get(key)
+            if entry is None or entry[0] != stamps:
+                context = ssl._create_stdlib_context(cert_reqs=cert_reqs,
+                                                     check_hostname=check_hostname,
+                                                     cafile=cafile, certfile=cert_file,
+                                                     keyfile=key_file)
+                if alpn_protocols is not None:
+                    context.set_alpn_protocols(list(alpn_protocols))
+                entry = self._contexts[key] = (stamps, context)
+            return entry[1]
+
+        def load_cert_chain(self, context, cert_file, key_file=None):
+            """context.load_cert_chain(), unless the same files are loaded
+            in it already."""
+            chain = (cert_file, key_file, _file_stamps(cert_file, key_file))
+            if self._chains.get(context) != chain:
+                context.load_cert_chain(cert_file, key_file)
+                self._chains[context] = chain
+
+        def clear(self):
+            self._contexts.clear()
+            self._chains.clear()
+
+    # used by HTTPSConnections not given a context
+    default_context_cache = SSLContextCache()
+
+    class _SessionContext(object):
+        """Stands in for an SSLContext, offering a saved session to the
+        connections it wraps so the handshake can resume it."""
+
+        def __init__(self, context, session):
+            self._context = context
+            self.session = session
+
+        def __getattr__(self, name):
+            return getattr(self._context, name)
+
+        def wrap_socket(self, *args, **kw):
+            kw.setdefault('session', self.session)
+            return self._context.wrap_socket(*args, **kw)
+
+        def wrap_bio(self, *args, **kw):
+            kw.setdefault('session', self.session)
+            return self._context.wrap_bio(*args, **kw)
+
+    class HTTPSConnection(HTTPConnection):
         "This class allows communication via SSL."
 
         default_port = HTTPS_PORT
@@ -1473,49 +3045,67 @@ else:
         def __init__(self, host, port=None, key_file=None, cert_file=None,
                      timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
                      source_address=None, context=None,
-                     check_hostname=None):
-            super(HTTPSConnection, self).__init__(host, port, timeout, source_address)
+                     check_hostname=None, resolver=None, session_cache=None):
+            super(HTTPSConnection, self).__init__(host, port, timeout, source_address,
+                                                  resolver=resolver)
             self.key_file = key_file
             self.cert_file = cert_file
             if context is None:
-                context = ssl._create_stdlib_context()
+                context = default_context_cache.get(cert_file=cert_file, key_file=key_file)
+            elif key_file or cert_file:
+                default_context_cache.load_cert_chain(context, cert_file, key_file)
             will_verify = context.verify_mode != ssl.CERT_NONE
             if check_hostname is None:
                 check_hostname = will_verify
             elif check_hostname and not will_verify:
                 raise ValueError("check_hostname needs a SSL context with "
                                  "either CERT_OPTIONAL or CERT_REQUIRED")
-            if key_file or cert_file:
-                context.load_cert_chain(cert_file, key_file)
             self._context = context
             self._check_hostname = check_hostname
+            # the protocol the server chose by ALPN, once connected
+            self.alpn_protocol = None
+            if session_cache is None:
+                session_cache = default_session_cache
+            self.session_cache = session_cache
+            # whether the last handshake resumed a cached TLS session
+            self.session_reused = False
 
         @asyncio.coroutine
         def connect(self):
             "Connect to a host on a given (SSL) port."
 
             if self._tunnel_host:
-                server_hostname = self._tunnel_host
+                server_hostname = self._get_hostport(self._tunnel_host, self._tunnel_port)[0]
             else:
                 server_hostname = self.host
 
             # self.soCk = yield From (self._create_connection((self.host, self.port), self.TIMEOUT,
             #                                                self.source_address, ssl=self._context,
             #                                                server_hostname=server_hostname)
+            context = self._context
+            session = self.session_cache.get(self._session_key())
+            if session is not None:
+                context = _SessionContext(context, session)
+            kw = self._connect_kw()
+            if self._tunnel_host:
+                # CONNECT in the clear, then TLS with the tunnelled server
+                kw['tunnel_request'] = self._tunnel_request()
             ns = yield From (self._create_connection((self.host, self.port), self.TIMEOUT,
-                                                      self.source_address, ssl=self._context,
-                                                      server_hostname=server_hostname))
+                                                      self.source_address, ssl=context,
+                                                      server_hostname=server_hostname,
+                                                      **kw))
 
             self.notSock = ns
 
-            if self._tunnel_host:
-                yield From (self._tunnel())
-                self.auto_open = 0
-
             #
             # self.soCk = self._context.wrap_socket(self.soCk, server_hostname=sni_hostname,
             #                                       do_handshake_on_connect=False)
             sock = self.notSock.socket()
+            ssl_object = self.notSock.ssl_object()
+            if hasattr(ssl_object, 'selected_alpn_protocol'):
+                self.alpn_protocol = ssl_object.selected_alpn_protocol()
+            self.session_reused = bool(getattr(ssl_object, 'session_reused', False))
+            self._save_session()
             if not self._context.check_hostname and self._check_hostname:
                 try:
                     ssl.match_hostname(sock.getpeercert(), server_hostname)
@@ -1523,8 +3113,26 @@ else:
                     self.close()
                     raise
 
+        def close(self):
+            self._save_session()
+            super(HTTPSConnection, self).close()
+
+        def _session_key(self):
+            if self._tunnel_host:
+                return self._get_hostport(self._tunnel_host, self._tunnel_port) + (self._context,)
+            return (self.host, self.port, self._context)
+
+        def _save_session(self):
+            # TLS 1.3 servers send session tickets after the handshake, so
+            # this is repeated when the connection closes
+            if self.notSock is None or self.notSock.writer is None:
+                return
+            session = getattr(self.notSock.ssl_object(), 'session', None)
+            if session is not None:
+                self.session_cache.put(self._session_key(), session)
 
-    __all__.append("HTTPSConnection")
+
+    __all__.extend(["HTTPSConnection", "TLSSessionCache", "SSLContextCache"])
 
 class HTTPException(Exception):
     # Subclasses that define an __init__ must call Exception.__init__
@@ -1575,6 +3183,10 @@ class CannotSendHeader(ImproperConnectionState):
 class ResponseNotReady(ImproperConnectionState):
     pass
 
+class PipelineAborted(ImproperConnectionState):
+    """A pipelined request was left unanswered, and could not be resent."""
+    pass
+
 class BadStatusLine(HTTPException):
     def __init__(self, line):
         if not line:
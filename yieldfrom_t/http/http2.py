@@ -0,0 +1,571 @@
+"""HTTP/2 client connections for yieldfrom_t.http.client
+
+An HTTP2Connection carries many concurrent requests over one socket,
+each on its own stream.  Framing, HPACK header compression and flow
+control are done by the h2 package, which must be installed.
+
+    conn = HTTP2Connection('localhost', 8443, context=context)
+    stream_id = yield From (conn.request('GET', '/pagename'))
+    resp = yield From (conn.getresponse(stream_id))
+    d = yield From (resp.read())
+
+Over TLS the connection offers 'h2' by ALPN, and fails with
+UnknownProtocol if the server does not accept it.  An SSLContext passed
+in is used as it is, so it must offer 'h2' itself:
+context.set_alpn_protocols(['h2']).  With secure=False it
+speaks h2c with prior knowledge, sending the HTTP/2 preface as soon as
+the TCP connection is made.
+
+negotiate() offers both 'h2' and 'http/1.1' (a context passed to it
+must do so), and returns a connected HTTP2Connection or HTTPSConnection,
+whichever the server chose.
+"""
+from __future__ import print_function
+import trollius as asyncio
+from trollius import From, Return
+import collections
+import socket
+
+import h2.config
+import h2.connection
+import h2.errors
+import h2.events
+
+from . import client
+
+__all__ = ["HTTP2Connection", "HTTP2Response", "StreamReset", "negotiate"]
+
+# amount to read from the socket at a time
+_READ_SIZE = 65536
+
+
+class StreamReset(client.HTTPException):
+    def __init__(self, stream_id, error_code):
+        self.args = stream_id, error_code
+        self.stream_id = stream_id
+        self.error_code = error_code
+
+
+def _native(s):
+    # header names and values arrive as bytes; HTTPMessage wants str
+    if isinstance(s, str):
+        return s
+    return s.decode('iso-8859-1')
+
+
+class _Stream(object):
+    """Receive state for one request, filled in by the frame reader."""
+
+    def __init__(self, method, loop):
+        self.method = method
+        self.headers = asyncio.Future(loop=loop)
+        # (data, flow controlled length) pairs not yet read
+        self.data = collections.deque()
+        self.ended = False
+        self.error = None
+        self.trailers = None
+        self.readable = asyncio.Event(loop=loop)
+        self.writable = asyncio.Event(loop=loop)
+        # set once getresponse() has taken the stream
+        self.claimed = False
+
+    def fail(self, exc):
+        if self.error is None:
+            self.error = exc
+        if not self.headers.done():
+            self.headers.set_exception(exc)
+        self.readable.set()
+        self.writable.set()
+
+
+class HTTP2Response(client.HTTPResponse):
+    """The response on one stream of an HTTP2Connection.
+
+    Has the reading and header methods of HTTPResponse; fp is the
+    stream while it is open, and None once the body is read.
+    """
+
+    def __init__(self, conn, stream_id, stream, debuglevel=0):
+        self.fp = stream
+        self.debuglevel = debuglevel
+        self.TIMEOUT = conn.TIMEOUT
+        self._conn = conn
+        self._method = stream.method
+        self.stream_id = stream_id
+
+        self.headers = self.msg = None
+        self.version = 20
+        self.status = client._UNKNOWN
+        self.reason = client._UNKNOWN
+
+        self.chunked = False
+        self.chunk_left = None
+        self.length = None
+        self.will_close = False
+        # bytes of the chunk at the front of stream.data already read
+        self._offset = 0
+
+    @asyncio.coroutine
+    def begin(self):
+        if self.headers is not None:
+            return
+        headers = yield From (asyncio.wait_for(self.fp.headers, self.TIMEOUT))
+        msg = client.HTTPMessage()
+        status = None
+        for name, value in headers:
+            name, value = _native(name), _native(value)
+            if name == ':status':
+                status = int(value)
+            elif not name.startswith(':'):
+                msg[name] = value
+        if status is None:
+            raise client.BadStatusLine(repr(headers))
+        self.code = self.status = status
+        self.reason = client.responses.get(status, '')
+        self.headers = self.msg = msg
+        if self.debuglevel > 0:
+            print("reply:", status, "stream", self.stream_id)
+
+        length = msg.get('content-length')
+        if length is not None:
+            try:
+                self.length = int(length)
+            except ValueError:
+                self.length = None
+        if (status == client.NO_CONTENT or status == client.NOT_MODIFIED or
+            100 <= status < 200 or self._method == 'HEAD'):
+            self.length = 0
+
+    def _close_conn(self):
+        if self.fp is not None:
+            self.fp = None
+            self._conn._forget(self.stream_id)
+
+    def close(self):
+        super(client.HTTPResponse, self).close() # set "closed" flag
+        if self.fp is not None:
+            if not self.fp.ended:
+                self._conn._reset_stream(self.stream_id)
+            self._close_conn()
+
+    @asyncio.coroutine
+    def _wait_for_data(self):
+        stream = self.fp
+        while not stream.data and not stream.ended and stream.error is None:
+            stream.readable.clear()
+            yield From (asyncio.wait_for(stream.readable.wait(), self.TIMEOUT))
+
+    @asyncio.coroutine
+    def _read_chunk(self, amt):
+        stream = self.fp
+        yield From (self._wait_for_data())
+        if not stream.data:
+            if stream.error is not None:
+                self._close_conn()
+                raise stream.error
+            raise Return (b'')
+        data, flow_length = stream.data[0]
+        if amt is None or len(data) - self._offset <= amt:
+            chunk = data[self._offset:]
+            stream.data.popleft()
+            self._offset = 0
+            # the server may send more now that this is consumed
+            self._conn._acknowledge(self.stream_id, flow_length)
+        else:
+            chunk = data[self._offset:self._offset + amt]
+            self._offset += amt
+        raise Return (chunk)
+
+    @asyncio.coroutine
+    def read(self, amt=None):
+        if self.fp is None:
+            raise Return (b"")
+        if amt is not None:
+            b = bytearray(amt)
+            n = yield From (self.readinto(b))
+            raise Return (memoryview(b)[:n].tobytes())
+        s = []
+        while True:
+            chunk = yield From (self._read_chunk(None))
+            if not chunk:
+                break
+            s.append(chunk)
+        self._close_conn()
+        raise Return (b''.join(s))
+
+    @asyncio.coroutine
+    def readinto(self, b):
+        if self.fp is None:
+            raise Return (0)
+        if not len(b):
+            raise Return (0)
+        data = yield From (self._read_chunk(len(b)))
+        n = len(data)
+        b[0:n] = data
+        if not n:
+            self._close_conn()
+        raise Return (n)
+
+    @asyncio.coroutine
+    def readline(self):
+        if self.fp is None or self._method == "HEAD":
+            raise Return (b"")
+        line = []
+        while True:
+            yield From (self._wait_for_data())
+            # read up to the end of the line, if it is in the next chunk
+            amt = None
+            if self.fp.data:
+                end = self.fp.data[0][0].find(b'\n', self._offset)
+                if end >= 0:
+                    amt = end + 1 - self._offset
+            chunk = yield From (self._read_chunk(amt))
+            if not chunk:
+                break
+            line.append(chunk)
+            if amt is not None:
+                break
+        result = b''.join(line)
+        if not result:
+            self._close_conn()
+        raise Return (result)
+
+
+class HTTP2Connection(object):
+    """Concurrent requests over a single HTTP/2 connection.
+
+    request() starts a stream, and returns its id; getresponse(stream_id)
+    returns the response on that stream.  Any number of requests may be
+    outstanding, up to the server's SETTINGS_MAX_CONCURRENT_STREAMS,
+    beyond which request() waits for a stream to finish.
+    """
+
+    response_class = HTTP2Response
+    debuglevel = 0
+    # bytes read at a time from file-like bodies, and the
+    # concurrent.futures executor the reads run in (None for the loop's
+    # default)
+    blocksize = 1 << 16
+    executor = None
+    # responses ended but not yet taken by getresponse() that are kept;
+    # beyond this many the oldest are discarded
+    max_unclaimed = 100
+
+    def __init__(self, host, port=None, secure=True,
+                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None,
+                 context=None, loop=None):
+        if type(timeout) == type(object()):
+            timeout = 30.0
+        self.TIMEOUT = timeout
+        self.host = host
+        self.secure = secure
+        if port is None:
+            port = client.HTTPS_PORT if secure else client.HTTP_PORT
+        self.port = port
+        self.source_address = source_address
+        if secure and context is None:
+            context = client.default_context_cache.get(alpn_protocols=['h2'])
+        self._context = context
+        self.loop = loop or asyncio.get_event_loop()
+        self.notSock = None
+        self._h2 = None
+        self._reader = None
+        self._streams = {}
+        # ids of streams which ended before getresponse() took them
+        self._unclaimed = collections.deque()
+        self._stream_closed = asyncio.Event(loop=self.loop)
+        # set by the server's GOAWAY; no further streams may be opened
+        self._goaway = False
+
+        # This is stored as an instance variable to allow unit
+        # tests to replace it with a suitable mockup
+        self._create_connection = client.create_connection
+
+    def set_debuglevel(self, level):
+        self.debuglevel = level
+
+    @asyncio.coroutine
+    def connect(self):
+        """Connect to the host and port, and send the HTTP/2 preface."""
+        if self.secure:
+            https = client.HTTPSConnection(self.host, self.port, timeout=self.TIMEOUT,
+                                           source_address=self.source_address,
+                                           context=self._context)
+            https._create_connection = self._create_connection
+            yield From (https.connect())
+            if https.alpn_protocol != 'h2':
+                https.close()
+                raise client.UnknownProtocol(https.alpn_protocol)
+            notSock = https.notSock
+            https.notSock = None
+        else:
+            notSock = yield From (self._create_connection((self.host, self.port), self.TIMEOUT,
+                                                          self.source_address))
+        self._start(notSock)
+
+    def is_usable(self):
+        """True if new requests may be sent on this connection: it is
+        connected, and the server has not sent GOAWAY."""
+        return self.notSock is not None and not self._goaway
+
+    def _start(self, notSock):
+        self.notSock = notSock
+        self._goaway = False
+        config = h2.config.H2Configuration(client_side=True)
+        self._h2 = h2.connection.H2Connection(config=config)
+        self._h2.initiate_connection()
+        self._flush()
+        self._reader = asyncio.ensure_future(self._read_frames(), loop=self.loop)
+
+    def close(self):
+        """Close the connection, failing any streams still open."""
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self.notSock is not None:
+            if self.notSock.writer is not None:
+                self._h2.close_connection()
+                self._flush()
+            self.notSock.close()
+            self.notSock = None
+        self._fail_streams(client.NotConnected('connection closed'))
+
+    def _flush(self):
+        data = self._h2.data_to_send()
+        if data and self.notSock is not None and self.notSock.writer is not None:
+            self.notSock.write(data)
+
+    @asyncio.coroutine
+    def _read_frames(self):
+        exc = None
+        try:
+            while True:
+                data = yield From (self.notSock.read(_READ_SIZE))
+                if not data:
+                    break
+                for event in self._h2.receive_data(data):
+                    self._handle_event(event)
+                self._flush()
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            exc = e
+        self._reader = None
+        if self.notSock is not None:
+            self.notSock.close()
+            self.notSock = None
+        self._fail_streams(exc or client.IncompleteRead(b''))
+
+    def _handle_event(self, event):
+        stream = self._streams.get(getattr(event, 'stream_id', None))
+        if isinstance(event, h2.events.ResponseReceived):
+            if stream is not None and not stream.headers.done():
+                stream.headers.set_result(event.headers)
+        elif isinstance(event, h2.events.DataReceived):
+            if stream is not None:
+                stream.data.append((event.data, event.flow_controlled_length))
+                stream.readable.set()
+            else:
+                # nobody will read it; give the window straight back
+                self._acknowledge(event.stream_id, event.flow_controlled_length)
+        elif isinstance(event, h2.events.TrailersReceived):
+            if stream is not None:
+                stream.trailers = event.headers
+        elif isinstance(event, h2.events.StreamEnded):
+            if stream is not None:
+                stream.ended = True
+                stream.readable.set()
+                self._note_unclaimed(event.stream_id, stream)
+            self._stream_closed.set()
+        elif isinstance(event, h2.events.StreamReset):
+            if stream is not None:
+                stream.fail(StreamReset(event.stream_id, event.error_code))
+                self._note_unclaimed(event.stream_id, stream)
+            self._stream_closed.set()
+        elif isinstance(event, (h2.events.WindowUpdated,
+                                h2.events.RemoteSettingsChanged)):
+            for s in self._streams.values():
+                s.writable.set()
+            if isinstance(event, h2.events.RemoteSettingsChanged):
+                # max_concurrent_streams may have gone up
+                self._stream_closed.set()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            self._goaway = True
+            exc = client.NotConnected('connection terminated, error %s' % event.error_code)
+            for stream_id, s in self._streams.items():
+                if stream_id > event.last_stream_id:
+                    s.fail(exc)
+            # wake requests waiting for a stream slot
+            self._stream_closed.set()
+
+    def _note_unclaimed(self, stream_id, stream):
+        # keep a bounded number of finished streams for getresponse()
+        if stream.claimed:
+            return
+        self._unclaimed.append(stream_id)
+        while len(self._unclaimed) > self.max_unclaimed:
+            old_id = self._unclaimed.popleft()
+            old = self._streams.get(old_id)
+            if old is not None and not old.claimed:
+                self._forget(old_id)
+
+    def _fail_streams(self, exc):
+        for stream in self._streams.values():
+            if not stream.ended:
+                stream.fail(exc)
+        self._stream_closed.set()
+
+    def _acknowledge(self, stream_id, flow_length):
+        if self.notSock is not None and flow_length:
+            self._h2.acknowledge_received_data(flow_length, stream_id)
+            self._flush()
+
+    def _reset_stream(self, stream_id):
+        if self.notSock is not None:
+            self._h2.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+            self._flush()
+
+    def _forget(self, stream_id):
+        self._streams.pop(stream_id, None)
+
+    @asyncio.coroutine
+    def _wait_for_stream_slot(self):
+        while (self._h2.open_outbound_streams >=
+               self._h2.remote_settings.max_concurrent_streams):
+            self._stream_closed.clear()
+            yield From (asyncio.wait_for(self._stream_closed.wait(), self.TIMEOUT))
+            if not self.is_usable():
+                raise client.NotConnected()
+
+    @asyncio.coroutine
+    def request(self, method, url, body=None, headers={}):
+        """Send a request on a new stream, and return the stream id.
+
+        ``body`` may be bytes, a str (encoded as iso-8859-1), a file-like
+        object with a .read() method or an iterable of bytes.  Raises
+        NotConnected once the server has sent GOAWAY; is_usable() tells
+        whether it has.
+        """
+        if self._goaway:
+            raise client.NotConnected('connection is going away')
+        if self.notSock is None:
+            yield From (self.connect())
+        yield From (self._wait_for_stream_slot())
+
+        authority = self.host
+        if authority.find(':') >= 0:
+            authority = '[%s]' % authority
+        default_port = client.HTTPS_PORT if self.secure else client.HTTP_PORT
+        if self.port != default_port:
+            authority = '%s:%d' % (authority, self.port)
+        request_headers = [(':method', method),
+                           (':scheme', 'https' if self.secure else 'http'),
+                           (':authority', authority),
+                           (':path', url or '/')]
+        header_names = set(k.lower() for k in headers)
+        if isinstance(body, str) and not isinstance(body, bytes):
+            body = body.encode('iso-8859-1')
+        if body is not None and 'content-length' not in header_names:
+            try:
+                request_headers.append(('content-length', str(len(body))))
+            except TypeError:
+                pass
+        for name, value in headers.items():
+            if not isinstance(value, (bytes, str)):
+                value = str(value)
+            request_headers.append((name.lower(), value))
+
+        stream_id = self._h2.get_next_available_stream_id()
+        stream = _Stream(method, self.loop)
+        self._streams[stream_id] = stream
+        if self.debuglevel > 0:
+            print("send:", method, url, "stream", stream_id)
+        self._h2.send_headers(stream_id, request_headers, end_stream=body is None)
+        self._flush()
+        if body is not None:
+            yield From (self._send_body(stream_id, stream, body))
+        raise Return (stream_id)
+
+    @asyncio.coroutine
+    def _send_body(self, stream_id, stream, body):
+        if isinstance(body, bytes):
+            yield From (self._send_data(stream_id, stream, body))
+        elif hasattr(body, 'read'):
+            # reads go to the executor, the next block being read while
+            # the last one is sent
+            reading = self.loop.run_in_executor(self.executor, body.read, self.blocksize)
+            while True:
+                block = yield From (reading)
+                if not block:
+                    break
+                reading = self.loop.run_in_executor(self.executor, body.read, self.blocksize)
+                if not isinstance(block, bytes):
+                    block = block.encode('iso-8859-1')
+                yield From (self._send_data(stream_id, stream, block))
+        else:
+            for block in body:
+                yield From (self._send_data(stream_id, stream, block))
+        self._h2.end_stream(stream_id)
+        self._flush()
+
+    @asyncio.coroutine
+    def _send_data(self, stream_id, stream, data):
+        """Send data on a stream, waiting whenever its window is used up."""
+        view = memoryview(data)
+        offset = 0
+        while offset < len(view):
+            if stream.error is not None:
+                raise stream.error
+            window = self._h2.local_flow_control_window(stream_id)
+            if window <= 0:
+                stream.writable.clear()
+                yield From (asyncio.wait_for(stream.writable.wait(), self.TIMEOUT))
+                continue
+            size = min(window, self._h2.max_outbound_frame_size, len(view) - offset)
+            self._h2.send_data(stream_id, view[offset:offset + size].tobytes())
+            offset += size
+            self._flush()
+            yield From (self.notSock.writer.drain())
+
+    @asyncio.coroutine
+    def getresponse(self, stream_id):
+        """Return the response to the request on stream `stream_id`."""
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            raise client.ResponseNotReady(stream_id)
+        stream.claimed = True
+        if self.debuglevel > 0:
+            response = self.response_class(self, stream_id, stream, self.debuglevel)
+        else:
+            response = self.response_class(self, stream_id, stream)
+        try:
+            yield From (response.begin())
+        except:
+            response.close()
+            raise
+        raise Return (response)
+
+
+@asyncio.coroutine
+def negotiate(host, port=None, context=None,
+              timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """Connect over TLS, offering both HTTP/2 and HTTP/1.1 by ALPN.
+
+    Returns a connected HTTP2Connection if the server chose h2, and a
+    connected HTTPSConnection otherwise.  A context passed in is not
+    changed; it should offer both protocols.
+    """
+    offer = context
+    if offer is None:
+        offer = client.default_context_cache.get(alpn_protocols=['h2', 'http/1.1'])
+    https = client.HTTPSConnection(host, port, timeout=timeout,
+                                   source_address=source_address, context=offer)
+    yield From (https.connect())
+    if https.alpn_protocol != 'h2':
+        raise Return (https)
+    conn = HTTP2Connection(https.host, https.port, timeout=timeout,
+                           source_address=source_address, context=context)
+    notSock = https.notSock
+    https.notSock = None
+    conn._start(notSock)
+    raise Return (conn)
@@ -0,0 +1,257 @@
+"""Concurrency limits for yieldfrom_t.http.client
+
+A ConcurrencyLimiter bounds the requests in flight to one origin; a
+HostLimiter holds one limiter per origin.  Waiting callers are let in
+in order of arrival.
+
+    limiter = HostLimiter(limit=10, max_queue=100)
+
+    waited = yield From (limiter.acquire('example.com', 443))
+    try:
+        yield From (conn.request('GET', '/'))
+        resp = yield From (conn.getresponse())
+        body = yield From (resp.read())
+    finally:
+        limiter.release('example.com', 443)
+
+acquire() returns the seconds spent queued, so that queueing can be
+told apart from network latency.
+
+An AdaptiveLimiter (or AdaptiveHostLimiter) also moves its limit with
+the upstream's health; tell release() how the request went, timing it
+from request() to the end of the body:
+
+    start = limiter.loop.time()
+    ...
+    limiter.release('example.com', 443, latency=limiter.loop.time() - start,
+                    status=resp.status)
+"""
+from __future__ import print_function
+import trollius as asyncio
+from trollius import From, Return
+import collections
+
+from . import client
+
+__all__ = ["ConcurrencyLimiter", "AdaptiveLimiter", "HostLimiter",
+           "AdaptiveHostLimiter", "QueueFull"]
+
+
+class QueueFull(client.HTTPException):
+    pass
+
+
+class ConcurrencyLimiter(object):
+    """At most `limit` holders at once; the rest wait, first come first
+    served.
+
+    With `max_queue` set, acquire() raises QueueFull at once rather
+    than join a queue of that many waiters.  `stats` counts the
+    acquisitions ('acquired'), those which had to wait ('queued'), those
+    refused ('rejected'), and the total and longest seconds spent
+    waiting ('wait_time', 'max_wait').
+    """
+
+    def __init__(self, limit=10, max_queue=None, loop=None):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.loop = loop or asyncio.get_event_loop()
+        self.in_use = 0
+        self.stats = {'acquired': 0, 'queued': 0, 'rejected': 0,
+                      'wait_time': 0.0, 'max_wait': 0.0}
+        self._waiters = collections.deque()
+
+    def __repr__(self):
+        return '<%s in_use=%d/%d queued=%d>' % (
+            self.__class__.__name__, self.in_use, self.limit, len(self._waiters))
+
+    @property
+    def num_waiting(self):
+        return len(self._waiters)
+
+    def locked(self):
+        return self.in_use >= self.limit or bool(self._waiters)
+
+    @asyncio.coroutine
+    def acquire(self, timeout=None):
+        """Wait for a free slot, and return the seconds waited.
+
+        Raises QueueFull if the queue is at max_queue, and
+        asyncio.TimeoutError if `timeout` seconds pass first.  Give the
+        slot back with release().
+        """
+        if not self.locked():
+            self.in_use += 1
+            self.stats['acquired'] += 1
+            raise Return (0.0)
+        if self.max_queue is not None and len(self._waiters) >= self.max_queue:
+            self.stats['rejected'] += 1
+            raise QueueFull(self)
+
+        start = self.loop.time()
+        waiter = asyncio.Future(loop=self.loop)
+        self._waiters.append(waiter)
+        try:
+            # release() counts the slot as taken when it wakes a waiter
+            yield From (asyncio.wait_for(waiter, timeout, loop=self.loop))
+        except:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # woken, but too late to use the slot
+                self.release()
+            raise
+        waited = self.loop.time() - start
+        self.stats['acquired'] += 1
+        self.stats['queued'] += 1
+        self.stats['wait_time'] += waited
+        self.stats['max_wait'] = max(self.stats['max_wait'], waited)
+        raise Return (waited)
+
+    def release(self):
+        """Give back a slot obtained from acquire()."""
+        self.in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        # hand free slots to the longest-waiting callers
+        while self._waiters and self.in_use < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(None)
+
+
+class AdaptiveLimiter(ConcurrencyLimiter):
+    """A ConcurrencyLimiter whose limit follows the upstream's latency.
+
+    While requests complete within `tolerance` times the lowest latency
+    seen, and the limit is being used, it grows by one per `limit`
+    requests.  A timeout, a 429 or 503 status, or a latency beyond the
+    tolerance multiplies it by `backoff`, at most once per smoothed
+    round trip, so that one burst of slow responses backs off only once.
+    The limit stays between `min_limit` and `max_limit`.
+
+    The lowest latency is forgotten every `probe_interval` samples, so
+    that it tracks a change of path or server.
+
+    The caller times its requests and passes the latency to release():
+    a slot is not tied to the task that acquired it (in trollius a
+    coroutine called with From() runs as a task of its own), so the
+    limiter cannot tell which acquire() a release() ends.  Releases with
+    no outcome are counted in stats['unmeasured'].
+    """
+
+    backoff_statuses = (client.TOO_MANY_REQUESTS, client.SERVICE_UNAVAILABLE)
+
+    def __init__(self, limit=10, max_queue=None, loop=None, min_limit=1,
+                 max_limit=1000, backoff=0.5, tolerance=2.0, smoothing=0.2,
+                 probe_interval=1000):
+        super(AdaptiveLimiter, self).__init__(limit, max_queue, loop)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        self.min_latency = None
+        self.smoothed_latency = None
+        self.stats.update({'increased': 0, 'decreased': 0, 'unmeasured': 0})
+        self._limit = float(limit)
+        self._samples = 0
+        self._last_backoff = None
+
+    def release(self, latency=None, status=None, timeout=False):
+        """Give back a slot, with the outcome of its request: the seconds
+        from request() to the end of the body, the response status, and
+        whether it timed out.  With none of these the limit is left as is."""
+        saturated = self.in_use >= self.limit
+        self.in_use -= 1
+        if latency is None and status is None and not timeout:
+            self.stats['unmeasured'] += 1
+        if latency is not None:
+            self._sample(latency)
+        if timeout or status in self.backoff_statuses:
+            self._decrease()
+        elif latency is not None:
+            if latency > self.min_latency * self.tolerance:
+                self._decrease()
+            elif saturated:
+                self._increase()
+        self._wake()
+
+    def _sample(self, latency):
+        self._samples += 1
+        if self.min_latency is None or self._samples >= self.probe_interval:
+            self.min_latency = latency
+            self._samples = 0
+        else:
+            self.min_latency = min(self.min_latency, latency)
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency += self.smoothing * (latency - self.smoothed_latency)
+
+    def _increase(self):
+        self._limit = min(self.max_limit, self._limit + 1.0 / self.limit)
+        if int(self._limit) > self.limit:
+            self.limit = int(self._limit)
+            self.stats['increased'] += 1
+
+    def _decrease(self):
+        now = self.loop.time()
+        if (self._last_backoff is not None and self.smoothed_latency is not None and
+                now - self._last_backoff < self.smoothed_latency):
+            return
+        self._last_backoff = now
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        if int(self._limit) < self.limit:
+            self.limit = int(self._limit)
+            self.stats['decreased'] += 1
+
+
+class HostLimiter(object):
+    """One ConcurrencyLimiter per (host, port), created as needed with
+    the given `limit` and `max_queue`, and any further keyword arguments
+    of the limiter class."""
+
+    limiter_class = ConcurrencyLimiter
+
+    def __init__(self, limit=10, max_queue=None, loop=None, **limiter_kw):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.loop = loop or asyncio.get_event_loop()
+        self.limiter_kw = limiter_kw
+        self.limiters = {}
+
+    def limiter_for(self, host, port=None):
+        key = (host, port)
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limiter = self.limiter_class(self.limit, self.max_queue, loop=self.loop,
+                                         **self.limiter_kw)
+            self.limiters[key] = limiter
+        return limiter
+
+    @asyncio.coroutine
+    def acquire(self, host, port=None, timeout=None):
+        """Wait for a slot for the origin; see ConcurrencyLimiter.acquire()."""
+        waited = yield From (self.limiter_for(host, port).acquire(timeout))
+        raise Return (waited)
+
+    def release(self, host, port=None, **outcome):
+        self.limiters[(host, port)].release(**outcome)
+
+    def stats(self):
+        """The stats of each limiter, keyed by (host, port)."""
+        return dict((key, dict(limiter.stats)) for key, limiter in self.limiters.items())
+
+
+class AdaptiveHostLimiter(HostLimiter):
+    """One AdaptiveLimiter per (host, port)."""
+
+    limiter_class = AdaptiveLimiter
+
+    def limits(self):
+        """The current limit of each limiter, keyed by (host, port)."""
+        return dict((key, limiter.limit) for key, limiter in self.limiters.items())
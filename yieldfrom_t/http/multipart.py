@@ -0,0 +1,114 @@
+"""Streamed multipart/form-data request bodies for yieldfrom_t.http.client
+
+A MultipartBody holds the fields and files of a form, and is sent by
+HTTPConnection.send() part by part, without the whole body being built
+in memory:
+
+    form = MultipartBody()
+    form.add_field('title', 'holiday')
+    form.add_file('photo', open('beach.jpg', 'rb'), content_type='image/jpeg')
+
+    yield From (conn.request('POST', '/upload', form))
+    resp = yield From (conn.getresponse())
+
+request() takes the Content-Type, with its boundary, from the body.
+When the size of every part is known (bytes, regular files, or a size
+given) the body has a len(), and goes with its Content-Length; otherwise
+it is sent with chunked transfer-coding.  Regular files are sent with
+sendfile(), as they would be alone.
+"""
+from __future__ import print_function
+import binascii
+import os
+
+from . import client
+
+__all__ = ["MultipartBody"]
+
+
+def _quote(value):
+    # a name or filename as a quoted-string of a Content-Disposition, as
+    # browsers send it
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return (b'"' + value.replace(b'"', b'%22').replace(b'\r', b'%0D')
+                        .replace(b'\n', b'%0A') + b'"')
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body.
+
+    Each part's data may be bytes (or str), a file-like object, an
+    iterable of bytes pieces, or a producer or async iterator, as for
+    HTTPConnection.send().  Files are sent from their current position.
+    """
+
+    def __init__(self, boundary=None):
+        if boundary is None:
+            boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.boundary = boundary
+        self._boundary = boundary.encode('ascii')
+        # (head, data, size) of each part; size None if it is not known
+        self.parts = []
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def add_field(self, name, value, content_type=None):
+        """Add a form field; a str value is sent as UTF-8."""
+        if not isinstance(value, client._BYTES_LIKE):
+            value = value.encode('utf-8')
+        self.add_part(name, value, content_type=content_type)
+
+    def add_file(self, name, data, filename=None, content_type='application/octet-stream',
+                 size=None):
+        """Add a file upload.  The filename defaults to the base name of
+        the file's name, if it has one."""
+        if filename is None:
+            filename = os.path.basename(getattr(data, 'name', None) or name)
+        self.add_part(name, data, filename, content_type, size)
+
+    def add_part(self, name, data, filename=None, content_type=None, size=None):
+        """Add a part.  Give the size of data that is neither bytes nor a
+        regular file if it is known, so the body can have a length."""
+        if not isinstance(data, client._BYTES_LIKE) and hasattr(data, 'encode'):
+            data = data.encode('utf-8')
+        head = [b'--' + self._boundary,
+                b'Content-Disposition: form-data; name=' + _quote(name)]
+        if filename is not None:
+            head[-1] += b'; filename=' + _quote(filename)
+        if content_type is not None:
+            head.append(b'Content-Type: ' + content_type.encode('latin-1'))
+        head.extend((b'', b''))
+        if size is None:
+            if isinstance(data, (list, tuple)):
+                size = sum(len(piece) for piece in data)
+            else:
+                size = client._body_length(data)
+        self.parts.append((b'\r\n'.join(head), data, size))
+
+    def __len__(self):
+        total = len(self._boundary) + 6
+        for head, data, size in self.parts:
+            if size is None:
+                raise TypeError("a part of the multipart body has no known size")
+            total += len(head) + size + 2
+        return total
+
+    def body_parts(self):
+        """The body as pieces for HTTPConnection.send(): lists of bytes,
+        each written in one gathered write, between the part data that
+        is streamed."""
+        pending = []
+        for head, data, size in self.parts:
+            pending.append(head)
+            if isinstance(data, client._BYTES_LIKE):
+                pending.append(data)
+            else:
+                yield pending
+                pending = []
+                yield data
+            pending.append(b'\r\n')
+        pending.append(b'--' + self._boundary + b'--\r\n')
+        yield pending
@@ -0,0 +1,308 @@
+"""Connection pools for yieldfrom_t.http.client
+
+A ConnectionPool keeps the idle keep-alive sockets for one origin, and
+hands them to new HTTPConnection objects, most recently used first.  A
+PoolManager holds one pool per origin, and caps the number of
+connections across all of them.
+
+    manager = PoolManager(maxsize=100, maxsize_per_origin=10)
+    pool = manager.connection_from_host('example.com', 443, scheme='https')
+
+    conn = yield From (pool.acquire())
+    try:
+        yield From (conn.request('GET', '/'))
+        resp = yield From (conn.getresponse())
+        body = yield From (resp.read())
+    finally:
+        pool.release(conn)
+
+A connection should be released only after its response has been read
+to the end; otherwise its socket is closed rather than kept.
+"""
+from __future__ import print_function
+import trollius as asyncio
+from trollius import From, Return
+import collections
+
+from . import client
+
+__all__ = ["ConnectionPool", "PoolManager", "PoolClosed"]
+
+
+class PoolClosed(client.HTTPException):
+    pass
+
+
+class ConnectionPool(object):
+    """Persistent connections to one origin.
+
+    At most `maxsize` connections are open at once, counting both those
+    handed out and those idle in the pool.  When the pool is full,
+    acquire() waits, in order of arrival, for a connection to be
+    released.  Idle sockets unused for `idle_timeout` seconds are closed.
+
+    `stats` counts the connections handed out on new sockets ('created')
+    and on idle ones ('reused').  With a tunnel, an idle socket is an
+    established CONNECT tunnel, and for https its TLS session with the
+    tunnelled server, so 'reused' counts the tunnels reused.
+
+    With the 'http+unix' scheme, `host` is the path of a Unix domain
+    socket and `port` is unused; pass `unix_host` for the Host header.
+    """
+
+    connection_classes = {'http': client.HTTPConnection,
+                          'http+unix': client.UnixHTTPConnection}
+    if hasattr(client, 'HTTPSConnection'):
+        connection_classes['https'] = client.HTTPSConnection
+
+    def __init__(self, host, port=None, scheme='http', maxsize=10,
+                 idle_timeout=60.0, context=None, tunnel=None,
+                 tunnel_headers=None, manager=None, loop=None,
+                 unix_host='localhost', **conn_kw):
+        if scheme not in self.connection_classes:
+            raise ValueError("unsupported scheme %r" % scheme)
+        self.scheme = scheme
+        self.connection_class = self.connection_classes[scheme]
+        if port is None and scheme != 'http+unix':
+            port = self.connection_class.default_port
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.context = context
+        self.tunnel = tunnel
+        self.tunnel_headers = tunnel_headers
+        self.unix_host = unix_host
+        self.manager = manager
+        self.loop = loop or asyncio.get_event_loop()
+        self.conn_kw = conn_kw
+        self.closed = False
+        self.stats = {'created': 0, 'reused': 0}
+
+        # idle (notSock, released_at) pairs, most recently released last
+        self._idle = collections.deque()
+        self._in_use = 0
+        self._waiters = collections.deque()
+
+    def __repr__(self):
+        return '<%s %s://%s:%s in_use=%d idle=%d>' % (
+            self.__class__.__name__, self.scheme, self.host, self.port,
+            self._in_use, len(self._idle))
+
+    @property
+    def num_connections(self):
+        return self._in_use + len(self._idle)
+
+    @property
+    def num_idle(self):
+        return len(self._idle)
+
+    def _new_conn(self):
+        kw = dict(self.conn_kw)
+        if self.context is not None:
+            kw['context'] = self.context
+        if self.scheme == 'http+unix':
+            conn = self.connection_class(self.host, self.unix_host, **kw)
+        else:
+            conn = self.connection_class(self.host, self.port, **kw)
+        if self.tunnel is not None:
+            conn.set_tunnel(self.tunnel[0], self.tunnel[1], self.tunnel_headers)
+        return conn
+
+    @asyncio.coroutine
+    def acquire(self, timeout=None):
+        """Return an HTTPConnection, on an idle socket if there is one.
+
+        Waits while the pool (or its manager) is full, raising
+        asyncio.TimeoutError if `timeout` seconds pass first.  Give the
+        connection back with release().
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = self.loop.time() + timeout
+        while True:
+            if self.closed:
+                raise PoolClosed(self)
+            self.purge()
+            while self._idle:
+                notSock, released_at = self._idle.pop()
+                if notSock.is_stale():
+                    notSock.close()
+                    continue
+                conn = self._new_conn()
+                conn.notSock = notSock
+                self._in_use += 1
+                self.stats['reused'] += 1
+                raise Return (conn)
+
+            if self.num_connections < self.maxsize:
+                if self.manager is None or self.manager._reserve(self):
+                    self._in_use += 1
+                    self.stats['created'] += 1
+                    raise Return (self._new_conn())
+
+            waiter = asyncio.Future(loop=self.loop)
+            self._waiters.append(waiter)
+            try:
+                if deadline is None:
+                    yield From (waiter)
+                else:
+                    yield From (asyncio.wait_for(waiter, deadline - self.loop.time(),
+                                                 loop=self.loop))
+            except:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # woken, but gone: pass the wakeup on
+                    if not self._wake() and self.manager is not None:
+                        self.manager._wake()
+                raise
+
+    def release(self, conn):
+        """Give back a connection obtained from acquire().
+
+        The socket is kept for reuse if the connection is idle and its
+        response was read to the end; otherwise it is closed.
+        """
+        self._in_use -= 1
+        notSock = conn.detach()
+        if notSock is not None:
+            if self.closed:
+                notSock.close()
+            else:
+                self._idle.append((notSock, self.loop.time()))
+        if not self._wake() and self.manager is not None:
+            self.manager._wake()
+
+    def _wake(self):
+        # let the longest-waiting acquire() retry
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+    def _evict_oldest(self):
+        notSock, released_at = self._idle.popleft()
+        notSock.close()
+
+    def purge(self):
+        """Close idle sockets which have gone unused for idle_timeout, or
+        which are stale: closed by the server, or near the idle timeout
+        it advertised."""
+        if self.idle_timeout is not None:
+            oldest = self.loop.time() - self.idle_timeout
+            while self._idle and self._idle[0][1] < oldest:
+                self._evict_oldest()
+        for item in [item for item in self._idle if item[0].is_stale()]:
+            self._idle.remove(item)
+            item[0].close()
+
+    def close(self):
+        """Close the idle sockets, and refuse further acquire() calls.
+
+        Connections already handed out are closed as they are released.
+        """
+        self.closed = True
+        while self._idle:
+            self._evict_oldest()
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(PoolClosed(self))
+
+
+class PoolManager(object):
+    """One ConnectionPool per origin, sharing a limit on total connections.
+
+    Pools are keyed by (scheme, host, port, context, tunnel), where
+    tunnel is the (host, port) to CONNECT to through a proxy.  When the
+    total limit is reached, opening a connection closes the least
+    recently used idle socket of any pool, or waits for one to be
+    released.
+    """
+
+    pool_class = ConnectionPool
+
+    def __init__(self, maxsize=100, maxsize_per_origin=10, idle_timeout=60.0,
+                 loop=None, **conn_kw):
+        self.maxsize = maxsize
+        self.maxsize_per_origin = maxsize_per_origin
+        self.idle_timeout = idle_timeout
+        self.loop = loop or asyncio.get_event_loop()
+        self.conn_kw = conn_kw
+        self.pools = {}
+        # pools with an acquire() waiting on the total limit
+        self._blocked = collections.deque()
+
+    @property
+    def num_connections(self):
+        return sum(pool.num_connections for pool in self.pools.values())
+
+    def connection_from_host(self, host, port=None, scheme='http',
+                             context=None, tunnel=None, tunnel_headers=None):
+        """Return the pool for an origin, creating it if needed."""
+        if port is None and scheme != 'http+unix':
+            port = self.pool_class.connection_classes[scheme].default_port
+        key = (scheme, host, port, context, tunnel)
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pool_class(host, port, scheme=scheme,
+                                   maxsize=self.maxsize_per_origin,
+                                   idle_timeout=self.idle_timeout,
+                                   context=context, tunnel=tunnel,
+                                   tunnel_headers=tunnel_headers,
+                                   manager=self, loop=self.loop,
+                                   **self.conn_kw)
+            self.pools[key] = pool
+        return pool
+
+    def tunnel_stats(self):
+        """The stats of the tunnelled pools, keyed by
+        (scheme, (proxy host, proxy port), (target host, target port))."""
+        stats = {}
+        for pool in self.pools.values():
+            if pool.tunnel is not None:
+                key = (pool.scheme, (pool.host, pool.port), pool.tunnel)
+                totals = stats.setdefault(key, {'created': 0, 'reused': 0})
+                for name, count in pool.stats.items():
+                    totals[name] += count
+        return stats
+
+    def _reserve(self, pool):
+        # called by a pool about to open a new connection
+        if self.num_connections < self.maxsize:
+            return True
+        if self._evict_lru():
+            return True
+        if pool not in self._blocked:
+            self._blocked.append(pool)
+        return False
+
+    def _evict_lru(self):
+        idle = [p for p in self.pools.values() if p._idle]
+        if not idle:
+            return False
+        min(idle, key=lambda p: p._idle[0][1])._evict_oldest()
+        return True
+
+    def _wake(self):
+        # a connection was released somewhere; let a blocked pool retry
+        while self._blocked:
+            pool = self._blocked.popleft()
+            if pool._wake():
+                if pool._waiters:
+                    # its other callers wait behind the other pools
+                    self._blocked.append(pool)
+                return
+
+    def purge(self):
+        for pool in list(self.pools.values()):
+            pool.purge()
+
+    def close(self):
+        for pool in list(self.pools.values()):
+            pool.close()
+        self.pools.clear()
+        self._blocked.clear()